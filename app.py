@@ -1,70 +1,69 @@
 
-import streamlit as st
 import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from dotenv import load_dotenv
 import pandas as pd
-import pdfplumber
-from openai import OpenAI
+from invoice_extraction.pipeline import ExtractionPipeline
+from invoice_extraction.transform import transform_data
 
 # Load environment variables
 load_dotenv()
 
-# Set up OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def extract_text_from_pdf(pdf_file):
-    """Extracts text from a given PDF file."""
-    with pdfplumber.open(pdf_file) as pdf:
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text()
-    return text
+# Per-file results kept in memory across reruns and sessions
+MAX_CACHED_FILES = 500
 
-def get_info_from_llm(text):
-    """Sends extracted text to OpenAI API and returns structured data."""
-    prompt = f"""
-    You are an expert data extractor. From the following invoice text, extract the specified fields and return the data in a clean JSON format.
-    If a field is not present, its value should be "N/A".
+# Files extracted at once; they share the pipeline's event loop, concurrency caps and rate limiter
+MAX_PARALLEL_FILES = int(os.getenv("STREAMLIT_MAX_PARALLEL_FILES", "5"))
 
-    The JSON keys should be exactly as specified in the "Fields to Extract" list.
+@st.cache_resource
+def get_pipeline() -> ExtractionPipeline:
+    """Returns the extraction pipeline shared with the API, created once per Streamlit server."""
+    return ExtractionPipeline()
 
-    **Fields to Extract:**
-    - "Buyer's Order No."
-    - "Quantity"
-    - "Rate"
-    - "Basic amount without tax"
-    - "IGST"
-    - "Total Amount"
-    - "InvoiceNo"
-    - "Ack Date"
-    - "GSTIN Number"
-    - "TML GSTIN"
-    - "IRN"
+@st.cache_data(max_entries=MAX_CACHED_FILES, show_spinner=False)
+def extract_file(content_hash: str, _data: bytes, _filename: str) -> dict:
+    """Extracts one PDF, memoized by its content hash; failures are not cached and are retried on the next run."""
+    return get_pipeline().extract_sync(_data, _filename)
 
-    **Extraction Guidelines:**
-    - "Quantity", "Rate", "Basic amount without tax", and "Total Amount" are usually found within the table describing the goods.
-    - For "Quantity" and "Rate", extract only the integer value. For example, if the quantity is "5 Nos", the value should be 5.
-    - For "InvoiceNo", look for a label like "Invoice No.". The value can be alphanumeric with slashes, like "SW/25-26/2513".
-    - For "Ack Date", look for a label like "Dated" or "Ack Date".
-    - For "IGST", find the value for IGST tax. It might be under a description of taxes.
-    - For "GSTIN Number", this is the GSTIN for the "Sunrise Wheels".
-    - For "TML GSTIN", this is the GSTIN for the "Buyer" or "Bill to" party.
+def process_files(uploaded_files, file_hashes):
+    """Extracts the files concurrently, showing progress, each file's status and rows as they finish.
 
-    **Invoice Text:**
-    ---
-    {text}
-    ---
+    Returns the extracted data in upload order, and an error message per failed file.
     """
-    
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant designed to extract information from documents and return it as a single JSON object. The keys in the JSON should be exactly as requested in the prompt."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    
-    return response.choices[0].message.content
+    progress = st.progress(0.0, text=f"Processing {len(uploaded_files)} files...")
+    statuses = [st.empty() for _ in uploaded_files]
+    for status, uploaded_file in zip(statuses, uploaded_files):
+        status.write(f"⏳ `{uploaded_file.name}`")
+    table = st.empty()
+
+    # Worker threads need the script's context to use st.cache_data
+    ctx = get_script_run_ctx()
+    results, errors = {}, []
+    with ThreadPoolExecutor(MAX_PARALLEL_FILES, initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as executor:
+        futures = {
+            executor.submit(extract_file, content_hash, uploaded_file.getvalue(), uploaded_file.name): index
+            for index, (uploaded_file, content_hash) in enumerate(zip(uploaded_files, file_hashes))
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            name = uploaded_files[index].name
+            # Parse, pre-extract, ask the LLM and validate, exactly as the API does
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                # Any failure, e.g. a locked cache database, only fails its own file
+                errors.append(f"Error extracting data from `{name}`: {e}")
+                statuses[index].write(f"❌ `{name}`: {e}")
+            else:
+                statuses[index].write(f"✅ `{name}`")
+                table.dataframe(transform_data(pd.DataFrame([results[i] for i in sorted(results)])))
+            progress.progress(done / len(futures), text=f"Processed {done} of {len(futures)} files")
+
+    return [results[index] for index in sorted(results)], errors
 
 def main():
     """Main function to run the Streamlit application."""
@@ -84,92 +83,22 @@ def main():
         if len(uploaded_files) > 10:
             st.error("You can only upload a maximum of 10 files at a time.")
         else:
-            all_data = []
-            for uploaded_file in uploaded_files:
-                st.write(f"Processing `{uploaded_file.name}`...")
-                
-                # Extract text from PDF
-                text = extract_text_from_pdf(uploaded_file)
-                
-                # Get structured data from LLM
-                extracted_data_str = get_info_from_llm(text)
-                
-                # Convert string response to dictionary (handle potential errors)
-                try:
-                    # The response from the LLM might be a string representation of a JSON.
-                    # We might need to clean it up before parsing.
-                    import json
-                    # A common issue is the LLM returning markdown with the JSON.
-                    if '```json' in extracted_data_str:
-                        extracted_data_str = extracted_data_str.split('```json\n')[1].split('```')[0]
-                    
-                    extracted_data = json.loads(extracted_data_str)
-                    all_data.append(extracted_data)
-                except (json.JSONDecodeError, IndexError) as e:
-                    st.error(f"Error parsing data for `{uploaded_file.name}`: {e}")
-                    st.text_area("LLM Response", extracted_data_str, height=200)
+            # Streamlit reruns this script on every interaction (including the download button), so the
+            # final table is kept in the session and only rebuilt when the set of uploaded files changes
+            file_hashes = tuple(hashlib.sha256(uploaded_file.getvalue()).hexdigest() for uploaded_file in uploaded_files)
+            if st.session_state.get("file_hashes") != file_hashes:
+                all_data, errors = process_files(uploaded_files, file_hashes)
+                st.session_state["file_hashes"] = file_hashes
+                st.session_state["errors"] = errors
+                st.session_state["final_df"] = get_pipeline().transform(all_data) if all_data else None
+                # Rerun once so the finished table replaces the live progress view
+                st.rerun()
+
+            for error in st.session_state["errors"]:
+                st.error(error)
 
-            if all_data:
-                # Convert the list of dictionaries to a pandas DataFrame
-                df = pd.DataFrame(all_data)
-                
-                # Rename the 'Buyer's Order No.' column to 'PoNumber'
-                if "Buyer's Order No." in df.columns:
-                    df.rename(columns={"Buyer's Order No.": "PoNumber"}, inplace=True)
-                    
-                if "InvoiceNo" in df.columns:
-                    df.rename(columns={"InvoiceNo": "Vendor Challan No"}, inplace=True)
-                
-                if "Ack Date" in df.columns:
-                    df.rename(columns={"Ack Date": "Challan Date"}, inplace=True)
-                
-                if "Basic amount without tax" in df.columns:
-                    df.rename(columns={"Basic amount without tax": "Basic value"}, inplace=True)
-                    
-                if "IGST" in df.columns:
-                    df.rename(columns={"IGST": "IGST VALUE"}, inplace=True)
-                
-                if "Total Amount" in df.columns:
-                    df.rename(columns={"Total Amount": "INVOICE VALUE"}, inplace=True)
-                    
-                if "Rate" in df.columns:
-                    df.rename(columns={"Rate": "Gross Rate"}, inplace=True)
-                
-                final_df = pd.DataFrame()
-                final_df['PO NUMBER'] = df['PoNumber']
-                final_df['PO Item No'] = ''
-                final_df['Quantity'] = df['Quantity']
-                final_df['VENDOR CHALLAN NO'] = df['Vendor Challan No']
-                final_df['Challan Date'] = df['Challan Date']
-                final_df['Gross Rate'] = df['Gross Rate']
-                final_df['Net P O Rate'] = df['Gross Rate']
-                final_df['Basic Value'] = df['Basic value']
-                final_df['Taxable Value'] = df['Basic value']
-                final_df['SGST VALUE'] = ''
-                final_df['CGST VALUE'] = ''
-                final_df['IGST VALUE'] = df['IGST VALUE']
-                final_df['SGST RATE'] = ''
-                final_df['CGST RATE'] = ''
-                final_df['IGST RATE'] = ''
-                final_df['Packing Amount'] = ''
-                final_df['Freight Amount'] = ''
-                final_df['Others Amount'] = '' 
-                final_df['INVOICE VALUE'] = df['INVOICE VALUE']
-                final_df['Currency'] = 'INR'
-                final_df['E Way Bill'] = ''
-                final_df['57F4 NUMBER'] = ''
-                final_df['57F4 NO DATE'] = ''
-                final_df['GSTIN Number'] = df['GSTIN Number']
-                final_df['Vehicle Number'] = ''
-                final_df['PART REV Level'] = ''
-                final_df['COP Certificate'] = ''
-                final_df['Certificate Date'] = ''
-                final_df['TML GSTIN'] = df['TML GSTIN']
-                final_df['Digital Invoice File Name'] = ''
-                final_df['IRN'] = df['IRN']
-                final_df['TCS Value'] = ''
-                final_df['Field4'] = ''
-                final_df['Field5'] = ''
+            final_df = st.session_state["final_df"]
+            if final_df is not None:
                 # Display the data in a table
                 st.success("Successfully extracted data from all files!")
                 st.dataframe(final_df)
@@ -184,4 +113,4 @@ def main():
                 )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
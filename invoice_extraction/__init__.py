@@ -0,0 +1,5 @@
+"""Shared invoice extraction engine used by the FastAPI service (main.py) and the Streamlit app (app.py)."""
+from dotenv import load_dotenv
+
+# Modules read their settings from the environment at import, so .env is loaded before any of them
+load_dotenv()
@@ -0,0 +1,139 @@
+"""Micro-batching of LLM extraction requests.
+
+Invoices waiting for the LLM within a short window are packed into one chat
+completion (up to a size and token budget) instead of one call each, so the
+instruction block is paid once per batch. Any invoice the batched answer
+doesn't fully cover falls back to its own single-invoice call.
+
+Invoices in a batch may come from different requests, so the shared call runs
+under the earliest of their deadlines and no request's trace, while each
+fallback runs in the context of the request that submitted its invoice.
+"""
+import os
+import asyncio
+import logging
+import itertools
+import contextvars
+from dataclasses import dataclass
+
+from invoice_extraction.resilience import remaining_time, request_deadline
+from invoice_extraction.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Invoices per LLM request (1 disables batching), seconds to wait for a batch to fill, and text tokens per batch
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+LLM_BATCH_WINDOW = float(os.getenv("LLM_BATCH_WINDOW", "0.25"))
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "6000"))
+
+
+@dataclass
+class BatchItem:
+    """One invoice waiting for the LLM."""
+    file_id: str
+    text: str
+    fields: list
+    tokens: int
+    future: asyncio.Future
+    # Context of the submitting request: its deadline and trace parent
+    context: contextvars.Context
+
+
+class InvoiceBatcher:
+    """Collects concurrent extraction requests and sends them to the LLM in batches.
+
+    call_batch(items) receives a list of BatchItem and returns {file_id: answer};
+    call_single(text, fields) extracts one invoice and is used for batches of
+    one and for fallbacks.
+    """
+
+    def __init__(self, call_batch, call_single, max_size: int = LLM_BATCH_SIZE, window: float = LLM_BATCH_WINDOW,
+                 token_budget: int = LLM_BATCH_TOKEN_BUDGET, model: str = "gpt-4"):
+        self.call_batch = call_batch
+        self.call_single = call_single
+        self.max_size = max_size
+        self.window = window
+        self.token_budget = token_budget
+        self.model = model
+        self._pending = []
+        self._timer = None
+        self._ids = itertools.count(1)
+        # Counters for tuning the batch size and window
+        self.batches = 0
+        self.batched_invoices = 0
+        self.fallbacks = 0
+
+    async def extract(self, text: str, fields: list) -> dict:
+        """Returns the requested fields for one invoice, extracted as part of a batch where possible."""
+        loop = asyncio.get_running_loop()
+        item = BatchItem(f"invoice-{next(self._ids)}", text, list(fields), count_tokens(text, self.model),
+                         loop.create_future(), contextvars.copy_context())
+        self._pending.append(item)
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await item.future
+
+    def _flush(self):
+        """Sends off as many pending invoices as fit in one batch and schedules the rest."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        group, tokens = [], 0
+        while self._pending and len(group) < self.max_size:
+            item = self._pending[0]
+            if group and tokens + item.tokens > self.token_budget:
+                break
+            group.append(self._pending.pop(0))
+            tokens += item.tokens
+        if group:
+            # A fresh context, so the batch doesn't inherit whichever request happened to trigger the flush
+            asyncio.get_running_loop().create_task(self._run(group), context=contextvars.Context())
+        if self._pending:
+            # Whatever didn't fit has already waited a full window, so it goes out straight away
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    async def _run(self, group: list):
+        # Skip invoices whose request was cancelled while waiting
+        group = [item for item in group if not item.future.done()]
+        if not group:
+            return
+        if len(group) == 1:
+            await self._run_single(group[0])
+            return
+
+        self.batches += 1
+        self.batched_invoices += len(group)
+        deadlines = [remaining for remaining in (item.context.run(remaining_time) for item in group) if remaining is not None]
+        try:
+            with request_deadline(min(deadlines) if deadlines else 0):
+                answers = await self.call_batch(group)
+        except Exception as e:
+            logger.warning("Batched extraction of %d invoices failed, falling back to single calls: %s", len(group), e)
+            answers = {}
+
+        incomplete = []
+        for item in group:
+            answer = answers.get(item.file_id)
+            if isinstance(answer, dict) and all(field in answer for field in item.fields):
+                if not item.future.done():
+                    item.future.set_result({field: answer[field] for field in item.fields})
+            else:
+                incomplete.append(item)
+        if incomplete:
+            self.fallbacks += len(incomplete)
+            logger.info("Batched answer missed %d of %d invoices; retrying them singly", len(incomplete), len(group))
+            await asyncio.gather(*(self._run_single(item) for item in incomplete))
+
+    async def _run_single(self, item: BatchItem):
+        try:
+            task = asyncio.get_running_loop().create_task(self.call_single(item.text, item.fields),
+                                                          context=item.context.copy())
+            result = await task
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+            return
+        if not item.future.done():
+            item.future.set_result(result)
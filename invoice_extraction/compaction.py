@@ -0,0 +1,153 @@
+"""Compaction of invoice text before it is sent to the LLM.
+
+Raw PDF text carries whitespace runs, page headers and footers repeated on
+every page, and boilerplate such as terms & conditions and bank details. This
+stage strips those, and if the text is still over the token budget keeps only
+the lines around the labels of the fields being asked for.
+"""
+import os
+import re
+import logging
+import threading
+from dataclasses import dataclass
+
+from invoice_extraction.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Maximum tokens of invoice text per prompt, and lines kept on each side of a field label
+PROMPT_TEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_TEXT_TOKEN_BUDGET", "3000"))
+LABEL_CONTEXT_LINES = int(os.getenv("LABEL_CONTEXT_LINES", "3"))
+
+# Headings that open a block of text no field is ever taken from; the block runs until the next field label
+BOILERPLATE_HEADING = re.compile(
+    r"terms\s*(?:&|and)\s*conditions|bank\s*details|company'?s\s*bank|declaration|"
+    r"subject\s*to\s*\w+\s*jurisdiction|computer\s*generated|authori[sz]ed\s*signatory|\bE\s*\.?\s*&\s*O\s*\.?\s*E\b",
+    re.IGNORECASE,
+)
+BOILERPLATE_BLOCK_LINES = 8
+
+# Label patterns that locate each prompt field in the invoice text
+FIELD_LABELS = {
+    "Buyer's Order No.": r"order\s*no|\bP\.?\s*O\b",
+    "Quantity": r"quantity|\bqty\b",
+    "Rate": r"\brate\b",
+    "Basic amount without tax": r"amount|taxable|total",
+    "IGST": r"\bIGST\b|integrated\s*tax",
+    "Total Amount": r"total|grand",
+    "InvoiceNo": r"invoice\s*no",
+    "Ack Date": r"ack\s*date|dated",
+    "GSTIN Number": r"GSTIN|sunrise",
+    "TML GSTIN": r"GSTIN|buyer|bill\s*to",
+    "IRN": r"\bIRN\b",
+}
+
+
+@dataclass
+class CompactionMetrics:
+    """Running totals of how many prompt tokens compaction has saved."""
+    calls: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def record(self, before: int, after: int):
+        with self._lock:
+            self.calls += 1
+            self.tokens_before += before
+            self.tokens_after += after
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+metrics = CompactionMetrics()
+
+
+def _normalize_lines(page: str) -> list:
+    lines = (re.sub(r"\s+", " ", line).strip() for line in page.splitlines())
+    return [line for line in lines if line]
+
+
+def _label_pattern(fields: list):
+    patterns = [FIELD_LABELS[field] for field in fields if field in FIELD_LABELS]
+    return re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+
+
+def _drop_repeated(pages: list) -> list:
+    """Flattens the pages, keeping only the first occurrence of lines repeated on most pages."""
+    if len(pages) < 2:
+        return [line for page in pages for line in page]
+    page_counts = {}
+    for page in pages:
+        for line in set(page):
+            page_counts[line] = page_counts.get(line, 0) + 1
+    repeated = {line for line, count in page_counts.items() if count >= 2 and count > len(pages) / 2}
+    seen, lines = set(), []
+    for page in pages:
+        for line in page:
+            if line in repeated:
+                if line in seen:
+                    continue
+                seen.add(line)
+            lines.append(line)
+    return lines
+
+
+def _drop_boilerplate(lines: list, labels) -> list:
+    kept, skipping = [], 0
+    for line in lines:
+        # A heading merged with a field label (two-column layouts become one line) is kept, and opens no block
+        has_label = bool(labels and labels.search(line))
+        if BOILERPLATE_HEADING.search(line) and not has_label:
+            skipping = BOILERPLATE_BLOCK_LINES
+            continue
+        if skipping and not has_label:
+            skipping -= 1
+            continue
+        skipping = 0
+        kept.append(line)
+    return kept
+
+
+def _near_labels(lines: list, labels) -> list:
+    """Keeps only the lines within LABEL_CONTEXT_LINES of a line mentioning one of the labels."""
+    keep = set()
+    for index, line in enumerate(lines):
+        if labels.search(line):
+            keep.update(range(max(index - LABEL_CONTEXT_LINES, 0), index + LABEL_CONTEXT_LINES + 1))
+    return [line for index, line in enumerate(lines) if index in keep]
+
+
+def _truncate(text: str, budget: int, model: str) -> str:
+    """Cuts text down to the token budget, dropping whole lines from the end."""
+    lines = text.split("\n")
+    while lines and count_tokens("\n".join(lines), model) > budget:
+        # Shrink proportionally first so long texts don't need one tokenization per dropped line
+        ratio = budget / count_tokens("\n".join(lines), model)
+        lines = lines[:min(len(lines) - 1, int(len(lines) * ratio))]
+    return "\n".join(lines)
+
+
+def compact_invoice_text(pages: list, fields: list, budget: int = PROMPT_TEXT_TOKEN_BUDGET,
+                         model: str = "gpt-4") -> str:
+    """Returns the invoice text to put in a prompt asking for the given fields, within the token budget."""
+    original = "\n".join(pages)
+    before = count_tokens(original, model)
+    labels = _label_pattern(fields)
+
+    lines = _drop_repeated([_normalize_lines(page) for page in pages])
+    lines = _drop_boilerplate(lines, labels)
+    text = "\n".join(lines)
+    if labels is not None and count_tokens(text, model) > budget:
+        text = "\n".join(_near_labels(lines, labels))
+    if count_tokens(text, model) > budget:
+        text = _truncate(text, budget, model)
+
+    after = count_tokens(text, model)
+    metrics.record(before, after)
+    logger.debug("Compacted invoice text from %d to %d tokens", before, after)
+    return text
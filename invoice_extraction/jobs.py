@@ -0,0 +1,254 @@
+"""Background extraction jobs for batches too large to process within one HTTP request.
+
+Jobs and their files live in SQLite so a batch survives a server restart: a
+job is leased by the worker processing it, and a job whose lease runs out
+(because its worker died) is picked up again by the next free worker. Files
+already processed keep their results and are not sent to the LLM twice.
+
+Uploads are stored one file at a time and each PDF is only loaded again when
+a worker starts on it, so a job's size is bounded by disk, not memory.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Job database, background workers per process, seconds between polls for new jobs, and job lease length
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+
+class JobStore:
+    """SQLite-backed store of extraction jobs and the files in them."""
+
+    def __init__(self, path: str = JOB_DB_PATH, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_until REAL NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_files ("
+                " job_id TEXT NOT NULL, position INTEGER NOT NULL, filename TEXT NOT NULL, data BLOB,"
+                " status TEXT NOT NULL, result TEXT, error TEXT, PRIMARY KEY (job_id, position))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create_job(self, total: int) -> str:
+        """Stores a new job of total files and returns its id.
+
+        The job isn't claimed until queue_job(); add its files with add_file() first.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, total, created_at, updated_at) VALUES (?, 'uploading', ?, ?, ?)",
+                (job_id, total, now, now),
+            )
+        return job_id
+
+    def add_file(self, job_id: str, position: int, filename: str, data: bytes):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_files (job_id, position, filename, data, status) VALUES (?, ?, ?, ?, 'queued')",
+                (job_id, position, filename, data),
+            )
+
+    def queue_job(self, job_id: str):
+        """Makes a job whose files are all added available to the workers."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def delete_job(self, job_id: str):
+        """Removes a job and its files, e.g. when its upload failed part-way."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def claim_job(self):
+        """Leases the oldest queued job, or a running one whose worker stopped renewing it; returns its id or None."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', lease_until = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease_seconds, now, row[0]),
+            )
+        return row[0]
+
+    def renew_lease(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() + self.lease_seconds, job_id))
+
+    def pending_files(self, job_id: str) -> list:
+        """Returns (position, filename) for the files of a job not processed yet."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT position, filename FROM job_files WHERE job_id = ? AND status = 'queued' ORDER BY position",
+                (job_id,),
+            ).fetchall()
+
+    def file_data(self, job_id: str, position: int) -> bytes:
+        """Returns the PDF bytes of one file of a job."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT data FROM job_files WHERE job_id = ? AND position = ?", (job_id, position)
+            ).fetchone()[0]
+
+    def record_file(self, job_id: str, position: int, result=None, error: str = None):
+        """Stores one file's outcome: its extracted data, None if nothing could be extracted, or an error."""
+        status = "failed" if error else ("done" if result is not None else "skipped")
+        now = time.time()
+        with self._connect() as conn:
+            # The PDF bytes aren't needed once the file is processed
+            conn.execute(
+                "UPDATE job_files SET status = ?, result = ?, error = ?, data = NULL WHERE job_id = ? AND position = ?",
+                (status, json.dumps(result) if result is not None else None, error, job_id, position),
+            )
+            conn.execute(
+                "UPDATE jobs SET updated_at = ?, lease_until = ? WHERE id = ?",
+                (now, now + self.lease_seconds, job_id),
+            )
+
+    def finish_job(self, job_id: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'completed', updated_at = ? WHERE id = ?", (now, job_id))
+
+    def get_job(self, job_id: str):
+        """Returns a job's status and progress counts, or None if there is no such job."""
+        with self._connect() as conn:
+            job = conn.execute(
+                "SELECT id, status, total, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM job_files WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        processed = sum(count for status, count in counts.items() if status != "queued")
+        return {
+            "job_id": job[0],
+            "status": job[1],
+            "total": job[2],
+            "processed": processed,
+            "succeeded": counts.get("done", 0),
+            "skipped": counts.get("skipped", 0),
+            "failed": counts.get("failed", 0),
+            "created_at": job[3],
+            "updated_at": job[4],
+        }
+
+    def results(self, job_id: str) -> list:
+        """Returns the extracted data of a job's successful files, in upload order."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT result FROM job_files WHERE job_id = ? AND status = 'done' ORDER BY position", (job_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def errors(self, job_id: str) -> list:
+        """Returns {filename, error} for each file of a job that failed."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT filename, error FROM job_files WHERE job_id = ? AND status = 'failed' ORDER BY position",
+                (job_id,),
+            ).fetchall()
+        return [{"filename": filename, "error": error} for filename, error in rows]
+
+
+class JobRunner:
+    """Background workers that claim queued jobs and run each file through an extraction coroutine.
+
+    process(data, filename) returns the extracted data for one PDF, or None to
+    skip it; any exception is recorded as that file's error.
+    """
+
+    def __init__(self, store: JobStore, process, workers: int = JOB_WORKERS, concurrency: int = 5,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.store = store
+        self.process = process
+        self.workers = workers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self):
+        while True:
+            try:
+                job_id = await asyncio.to_thread(self.store.claim_job)
+                if job_id is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                await self.run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker error")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _keep_leased(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            await asyncio.to_thread(self.store.renew_lease, job_id)
+
+    async def run_job(self, job_id: str):
+        files = await asyncio.to_thread(self.store.pending_files, job_id)
+        logger.info("Running job %s with %d pending files", job_id, len(files))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_file(position, filename):
+            async with semaphore:
+                try:
+                    # Loaded only once a slot is free, so at most `concurrency` PDFs are in memory
+                    data = await asyncio.to_thread(self.store.file_data, job_id, position)
+                    result = await self.process(data, filename)
+                except Exception as e:
+                    detail = getattr(e, "detail", None) or str(e)
+                    await asyncio.to_thread(self.store.record_file, job_id, position, None, detail)
+                    return
+            await asyncio.to_thread(self.store.record_file, job_id, position, result)
+
+        lease = asyncio.create_task(self._keep_leased(job_id))
+        try:
+            await asyncio.gather(*(run_file(*file) for file in files))
+        finally:
+            lease.cancel()
+        await asyncio.to_thread(self.store.finish_job, job_id)
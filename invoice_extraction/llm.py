@@ -0,0 +1,188 @@
+"""LLM calls for the fields no local stage could read.
+
+Every call goes through the shared rate limiter and the resilient caller,
+answers through a forced tool call whose parameters are the typed field
+schema, and is validated before it is used.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import List, Optional
+
+from openai import AsyncOpenAI, RateLimitError
+
+from invoice_extraction.batching import LLM_BATCH_SIZE, BatchItem, InvoiceBatcher
+from invoice_extraction.compaction import compact_invoice_text
+from invoice_extraction.metrics import LLM_UNPARSEABLE, record_usage
+from invoice_extraction.prompts import FIELDS, build_batch_prompt, build_prompt, build_repair_prompt
+from invoice_extraction.rate_limit import RateLimitScheduler
+from invoice_extraction.resilience import DeadlineExceeded, ResilientCaller
+from invoice_extraction.routing import TierRouter
+from invoice_extraction.schema import NOT_AVAILABLE, batch_schema, invoice_schema, validate_fields
+from invoice_extraction.tokens import count_tokens
+from invoice_extraction.tracing import stage, tracer
+
+logger = logging.getLogger(__name__)
+
+# Set up OpenAI client; retries are handled by llm_caller, not the SDK
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+LLM_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+
+# With LLM_FAST_MODEL set, invoices go to that model first and only escalate to LLM_MODEL when its answer fails the checks
+llm_router = TierRouter(LLM_MODEL)
+
+# The LLM answers through this forced tool call, whose parameters are the typed field schema
+EXTRACTION_TOOL = "record_invoice_fields"
+# Strict schema enforcement needs a model with structured-output support (e.g. gpt-4o); plain gpt-4 rejects it
+STRICT_SCHEMA = os.getenv("OPENAI_STRICT_SCHEMA", "false").lower() == "true"
+# Token budget of the invoice text sent with a repair call for invalid fields
+REPAIR_TOKEN_BUDGET = int(os.getenv("REPAIR_TOKEN_BUDGET", "800"))
+
+# Requests/tokens per minute shared by every worker on this host; answers are counted at this size until usage is known
+llm_scheduler = RateLimitScheduler()
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "300"))
+
+# Transient LLM failures are retried with jittered backoff, and slow calls hedged, within the request's deadline
+llm_caller = ResilientCaller()
+
+
+class LLMError(Exception):
+    """Raised when the OpenAI API call fails for good."""
+
+
+async def chat_completion(prompt: str, schema: dict, model: str = LLM_MODEL, kind: str = "extract") -> dict:
+    """Sends a prompt to the OpenAI API and returns the arguments of its forced extraction tool call.
+
+    kind ("extract", "repair" or "batch") keeps the hedging latencies of differently sized calls apart.
+    """
+    request = dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant designed to extract information from documents and return it as a single JSON object. The keys in the JSON should be exactly as requested in the prompt."},
+            {"role": "user", "content": prompt}
+        ],
+        tools=[{
+            "type": "function",
+            "function": {
+                "name": EXTRACTION_TOOL,
+                "description": "Records the fields extracted from the invoice text.",
+                "parameters": schema,
+                "strict": STRICT_SCHEMA,
+            },
+        }],
+        tool_choice={"type": "function", "function": {"name": EXTRACTION_TOOL}},
+    )
+
+    # Every attempt, retries and hedges included, waits for room in the shared per-minute budgets;
+    # a 429 pauses every worker before the attempt is retried
+    estimated_tokens = count_tokens(prompt, model) + count_tokens(json.dumps(schema), model) + LLM_COMPLETION_TOKEN_ESTIMATE
+
+    async def send(timeout: float):
+        # One span per attempt, so retries and hedged duplicates show up in the trace
+        with tracer.start_as_current_span("llm_attempt", attributes={"llm.timeout_seconds": timeout}):
+            try:
+                response = await client.chat.completions.create(**request, timeout=timeout)
+            except RateLimitError:
+                await llm_scheduler.back_off()
+                raise
+        usage = getattr(response, "usage", None)
+        record_usage(model, usage)
+        await llm_scheduler.reconcile(estimated_tokens, usage.total_tokens if usage else None)
+        return response
+
+    started = time.monotonic()
+    attributes = {"llm.model": model, "llm.call_kind": kind, "llm.estimated_tokens": estimated_tokens,
+                  "llm.prompt_length": len(prompt)}
+    with tracer.start_as_current_span("chat_completion", attributes=attributes) as span:
+        try:
+            response = await llm_caller.call(send, prepare=lambda: llm_scheduler.acquire(estimated_tokens),
+                                             key=(model, kind))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            raise LLMError(f"Error calling OpenAI API: {e}") from e
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            span.set_attributes({"llm.prompt_tokens": usage.prompt_tokens, "llm.completion_tokens": usage.completion_tokens})
+    llm_router.record(model, time.monotonic() - started, usage)
+
+    message = response.choices[0].message
+    try:
+        with stage("json_parse"):
+            if message.tool_calls:
+                return json.loads(message.tool_calls[0].function.arguments)
+            # A model that ignores tool_choice answers in the message text instead
+            return parse_llm_json(message.content or "")
+    except (json.JSONDecodeError, IndexError) as e:
+        # Whatever could be read is kept; validation then asks again for the missing fields only
+        logger.warning("Unparseable LLM response: %s", e)
+        LLM_UNPARSEABLE.inc()
+        return {}
+
+
+async def get_info_from_llm(text: str, fields: List[str] = FIELDS, model: str = LLM_MODEL) -> dict:
+    """Sends extracted text to OpenAI API and returns structured data for the requested fields."""
+    return await chat_completion(build_prompt(text, fields), invoice_schema(fields), model)
+
+
+def parse_llm_json(extracted_data_str: str):
+    """Parses the JSON in an LLM answer, which may be wrapped in a markdown code fence."""
+    if '```json' in extracted_data_str:
+        extracted_data_str = extracted_data_str.split('```json\n')[1].split('```')[0]
+    return json.loads(extracted_data_str)
+
+
+async def validate_answer(text: str, answer: dict, fields: List[str], model: str = LLM_MODEL) -> dict:
+    """Validates an LLM answer and repairs only its invalid fields with a targeted follow-up call."""
+    valid, errors = validate_fields(answer, fields)
+    if not errors:
+        return valid
+
+    # The repair prompt only needs the text around the rejected fields' labels
+    repair_text = compact_invoice_text([text], list(errors), budget=REPAIR_TOKEN_BUDGET, model=model)
+    repaired = await chat_completion(build_repair_prompt(repair_text, answer, errors), invoice_schema(list(errors)), model,
+                                     kind="repair")
+    repaired_valid, still_invalid = validate_fields(repaired, list(errors))
+    valid.update(repaired_valid)
+    for field, error in still_invalid.items():
+        logger.warning("Field '%s' still invalid after repair (%s); using N/A", field, error)
+        valid[field] = NOT_AVAILABLE
+    return valid
+
+
+async def get_fields_from_llm(text: str, fields: List[str], model: Optional[str] = None) -> dict:
+    """Asks the LLM (by default the first routing tier) for one invoice's fields and returns them validated."""
+    model = model or llm_router.first_model
+    answer = await get_info_from_llm(text, fields, model)
+    return await validate_answer(text, answer, fields, model)
+
+
+async def reextract_fields(text: str, answer: dict, errors: dict) -> dict:
+    """Asks the main model again for fields that failed the consistency checks, and returns the valid answers."""
+    fields = list(errors)
+    repaired = await chat_completion(build_repair_prompt(text, answer, errors), invoice_schema(fields), LLM_MODEL,
+                                     kind="repair")
+    valid, _ = validate_fields(repaired, fields)
+    return valid
+
+
+async def get_batch_fields_from_llm(items: List[BatchItem]) -> dict:
+    """Asks the LLM for several invoices' fields in one call and returns {file_id: fields}."""
+    all_fields = [field for field in FIELDS if any(field in item.fields for item in items)]
+    answer = await chat_completion(build_batch_prompt(items), batch_schema(all_fields), llm_router.first_model,
+                                   kind="batch")
+    entries = {
+        str(entry.get("file_id")): entry
+        for entry in answer.get("invoices", []) if isinstance(entry, dict)
+    }
+    answered = [item for item in items if item.file_id in entries]
+    validated = await asyncio.gather(*(
+        validate_answer(item.text, entries[item.file_id], item.fields, llm_router.first_model) for item in answered
+    ))
+    return {item.file_id: fields for item, fields in zip(answered, validated)}
+
+
+# With LLM_BATCH_SIZE > 1, invoices reaching the LLM at about the same time share one request
+batcher = InvoiceBatcher(get_batch_fields_from_llm, get_fields_from_llm, model=LLM_MODEL) if LLM_BATCH_SIZE > 1 else None
@@ -0,0 +1,88 @@
+"""Prometheus metrics of the extraction engine, served by the API at /metrics.
+
+Per-stage latency histograms, file outcome and LLM token counters and
+in-flight gauges are updated as files go through the pipeline. Counters the
+engine already keeps (compaction savings, batcher, rate limiter, routing
+tiers, retries) are read at scrape time by EngineCollector.
+"""
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Covers cache lookups (milliseconds) up to slow multi-page LLM calls (minutes)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "invoice_extraction_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=STAGE_BUCKETS,
+)
+FILES = Counter(
+    "invoice_extraction_files_total",
+    "Files by outcome: processed, cached, skipped (no field could be read) or failed",
+    ["outcome"],
+)
+LLM_TOKENS = Counter("invoice_extraction_llm_tokens_total", "Tokens reported by the OpenAI API", ["model", "kind"])
+LLM_UNPARSEABLE = Counter("invoice_extraction_llm_unparseable_total", "LLM answers that were not valid JSON")
+IN_FLIGHT = Gauge("invoice_extraction_in_flight", "Requests and files being processed", ["kind"])
+
+
+def time_stage(stage: str):
+    """Returns a context manager recording the duration of one pipeline stage."""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def record_usage(model: str, usage):
+    """Counts the prompt and completion tokens of one OpenAI response, if it reported them."""
+    if usage is None:
+        return
+    LLM_TOKENS.labels(model, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(model, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+class EngineCollector:
+    """Exports the engine's own counters when Prometheus scrapes."""
+
+    def describe(self):
+        # Without this the registry calls collect() on registration, before the engine modules are loaded
+        return []
+
+    def collect(self):
+        # Imported here since those modules record into this one
+        from invoice_extraction import compaction, llm
+
+        tokens = CounterMetricFamily(
+            "invoice_extraction_compaction_tokens", "Prompt tokens before and after compaction", labels=["stage"],
+        )
+        tokens.add_metric(["before"], compaction.metrics.tokens_before)
+        tokens.add_metric(["after"], compaction.metrics.tokens_after)
+        yield tokens
+
+        status = llm.llm_scheduler.status()
+        yield GaugeMetricFamily("invoice_extraction_llm_queue_depth", "LLM calls waiting for rate-limit budget",
+                                value=status["queue_depth"])
+
+        yield CounterMetricFamily("invoice_extraction_llm_retries", "LLM attempts retried after a transient error",
+                                  value=llm.llm_caller.retries)
+        yield CounterMetricFamily("invoice_extraction_llm_hedges", "Hedged LLM requests sent", value=llm.llm_caller.hedges)
+
+        if llm.batcher is not None:
+            batches = CounterMetricFamily("invoice_extraction_llm_batches", "Batched LLM requests", labels=["kind"])
+            batches.add_metric(["batches"], llm.batcher.batches)
+            batches.add_metric(["invoices"], llm.batcher.batched_invoices)
+            batches.add_metric(["fallbacks"], llm.batcher.fallbacks)
+            yield batches
+
+        tiers = llm.llm_router.status()["tiers"]
+        calls = CounterMetricFamily("invoice_extraction_llm_tier_calls", "LLM calls per routing tier", labels=["model"])
+        escalations = CounterMetricFamily(
+            "invoice_extraction_llm_tier_escalations", "Invoices escalated from each tier", labels=["model"],
+        )
+        cost = CounterMetricFamily("invoice_extraction_llm_cost_usd", "Estimated LLM cost per tier", labels=["model"])
+        for model, tier in tiers.items():
+            calls.add_metric([model], tier["calls"])
+            escalations.add_metric([model], tier["escalations"])
+            cost.add_metric([model], tier["cost_usd"])
+        yield calls
+        yield escalations
+        yield cost
+
+
+REGISTRY.register(EngineCollector())
@@ -0,0 +1,252 @@
+"""Process-pool backed PDF text extraction.
+
+pdfplumber's layout analysis is pure Python and CPU-bound, so parsing runs in
+worker processes instead of threads to use more than one core.
+
+Workers report each job as they start it, so the job timeout only counts
+parsing time, not time queued. A job that runs past it has its worker killed
+and the pool replaced; other jobs that were in flight are retried once on the
+new pool.
+"""
+import os
+import io
+import signal
+import asyncio
+import logging
+import itertools
+import threading
+import multiprocessing
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pdfplumber
+
+from invoice_extraction.qr import decode_qr_fields
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes, seconds a caller waits for one PDF, and jobs a worker runs before it is replaced
+PDF_POOL_SIZE = int(os.getenv("PDF_POOL_SIZE", str(os.cpu_count() or 2)))
+PDF_JOB_TIMEOUT = float(os.getenv("PDF_JOB_TIMEOUT", "60"))
+PDF_JOBS_PER_WORKER = int(os.getenv("PDF_JOBS_PER_WORKER", "100"))
+
+# Pages parsed per PDF; the rest of longer documents (e.g. statements) is ignored. 0 means no limit
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+
+
+class PdfExtractionError(Exception):
+    """Raised when a PDF can't be parsed or parsing exceeds the job timeout."""
+
+
+@dataclass
+class ParsedPdf:
+    """What a pool worker extracts from one PDF."""
+    text: str
+    # Text of each page, which prompt compaction uses to spot repeated headers and footers
+    pages: list = field(default_factory=list)
+    # Fields read from the signed e-invoice QR code, keyed like the LLM prompt's fields
+    qr_fields: dict = field(default_factory=dict)
+    # First-page words with their coordinates, used by the layout templates
+    words: list = field(default_factory=list)
+
+
+def iter_pages(pdf, max_pages: int = PDF_MAX_PAGES):
+    """Yields the pages of an open PDF one at a time, up to max_pages.
+
+    Each page's parsed layout objects are released as soon as the caller moves
+    on, so memory stays bounded by a single page however long the document is.
+    """
+    for number, page in enumerate(pdf.pages):
+        if max_pages and number >= max_pages:
+            break
+        try:
+            yield page
+        finally:
+            page.close()
+
+
+def parse_pdf(data: bytes) -> ParsedPdf:
+    """Extracts text, e-invoice QR fields and first-page words from the given PDF bytes. Runs inside a pool worker."""
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        page_texts = []
+        qr_fields, words = {}, []
+        for number, page in enumerate(iter_pages(pdf)):
+            page_texts.append(page.extract_text() or "")
+            if number == 0:
+                # The signed QR code and the header fields are on the first page
+                qr_fields = decode_qr_fields(page, page_texts[0])
+                words = [
+                    {key: word[key] for key in ("text", "x0", "x1", "top", "bottom")}
+                    for word in page.extract_words()
+                ]
+    return ParsedPdf(text="\n".join(page_texts), pages=page_texts, qr_fields=qr_fields, words=words)
+
+
+_started_jobs = None
+
+
+def _set_started(started: asyncio.Future, pid: int):
+    if not started.done():
+        started.set_result(pid)
+
+
+def _init_worker(started_jobs):
+    global _started_jobs
+    _started_jobs = started_jobs
+
+
+def _run_job(job_id: int, data: bytes) -> ParsedPdf:
+    """Reports the job as started, with the worker's pid, then parses it. Runs inside a pool worker."""
+    _started_jobs.put((job_id, os.getpid()))
+    return parse_pdf(data)
+
+
+def _warm_up() -> int:
+    """No-op job used to start a worker and import pdfplumber ahead of the first real upload."""
+    return os.getpid()
+
+
+class PdfExtractionPool:
+    """A pool of warm worker processes that PDF parsing jobs are submitted to."""
+
+    def __init__(self, max_workers: int = PDF_POOL_SIZE, job_timeout: float = PDF_JOB_TIMEOUT,
+                 max_jobs_per_worker: int = PDF_JOBS_PER_WORKER):
+        self.max_workers = max_workers
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._executor = None
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        # Jobs waiting to be picked up by a worker: job id -> (event loop, future of the worker's pid)
+        self._waiting = {}
+        self._started_jobs = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context("spawn")
+                if self._started_jobs is None:
+                    self._started_jobs = context.SimpleQueue()
+                    threading.Thread(target=self._watch_started_jobs, args=(self._started_jobs,), daemon=True,
+                                     name="pdf-pool-started-jobs").start()
+                # max_tasks_per_child recycles workers to cap pdfminer's memory growth; it requires spawn
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    max_tasks_per_child=self.max_jobs_per_worker,
+                    initializer=_init_worker,
+                    initargs=(self._started_jobs,),
+                )
+            return self._executor
+
+    def _watch_started_jobs(self, started_jobs):
+        """Hands each started job's worker pid to the coroutine waiting on it, until shutdown() sends None."""
+        for job_id, pid in iter(started_jobs.get, None):
+            waiter = self._waiting.get(job_id)
+            if waiter is None:
+                continue
+            loop, started = waiter
+            try:
+                loop.call_soon_threadsafe(_set_started, started, pid)
+            except RuntimeError:
+                # The caller's event loop has closed
+                pass
+
+    def _reset(self, broken):
+        """Replaces an executor whose worker died (e.g. killed for memory) so later jobs still run."""
+        with self._lock:
+            if broken is None or self._executor is not broken:
+                return
+            self._executor = None
+        logger.warning("PDF worker pool broke; starting a new one")
+        # Jobs still in the broken pool fail with BrokenProcessPool and are retried by their callers
+        broken.shutdown(wait=False)
+
+    def _kill_worker(self, executor, pid: int):
+        """Kills a worker stuck on a job and replaces the pool, which a dead worker breaks."""
+        logger.warning("Killing PDF worker %d after a job ran past %gs", pid, self.job_timeout)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            # The worker already exited
+            pass
+        self._reset(executor)
+
+    def start(self):
+        """Spawns the workers up front so the first uploads don't pay process start-up."""
+        executor = self._get_executor()
+        for _ in range(self.max_workers):
+            executor.submit(_warm_up)
+
+    def submit(self, job_id: int, data: bytes):
+        """Queues a PDF for parsing and returns the executor and the future of its ParsedPdf."""
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(_run_job, job_id, data)
+        except BrokenProcessPool:
+            self._reset(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(_run_job, job_id, data)
+
+    async def _parse_once(self, data: bytes) -> ParsedPdf:
+        loop = asyncio.get_running_loop()
+        job_id = next(self._job_ids)
+        started = loop.create_future()
+        self._waiting[job_id] = (loop, started)
+        try:
+            executor, future = self.submit(job_id, data)
+            result = asyncio.wrap_future(future)
+            try:
+                # The timeout counts from when a worker picks the job up, not while it waits in the queue
+                await asyncio.wait({result, started}, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                result.cancel()
+                raise
+            try:
+                return await asyncio.wait_for(result, timeout=self.job_timeout)
+            except asyncio.TimeoutError:
+                self._kill_worker(executor, started.result())
+                raise PdfExtractionError(f"PDF parsing timed out after {self.job_timeout:g}s")
+            except BrokenProcessPool:
+                self._reset(executor)
+                raise
+        finally:
+            del self._waiting[job_id]
+
+    async def parse_async(self, data: bytes) -> ParsedPdf:
+        """Parses PDF bytes without blocking the event loop."""
+        for attempt in (1, 2):
+            try:
+                return await self._parse_once(data)
+            except PdfExtractionError:
+                raise
+            except BrokenProcessPool as e:
+                # Another job's worker may have been killed; retry once on the new pool before giving up
+                if attempt == 2:
+                    raise PdfExtractionError(f"PDF worker crashed: {e}")
+            except Exception as e:
+                raise PdfExtractionError(e)
+
+    def shutdown(self):
+        """Stops the workers, cancelling any queued jobs."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            started_jobs, self._started_jobs = self._started_jobs, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if started_jobs is not None:
+            started_jobs.put(None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> PdfExtractionPool:
+    """Returns the process-wide extraction pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PdfExtractionPool()
+        return _pool
@@ -0,0 +1,205 @@
+"""The extraction pipeline shared by the FastAPI service and the Streamlit app.
+
+A PDF goes through parse -> pre-extract -> LLM -> validate, and extracted
+rows through transform. Each stage is a constructor argument, so an entry
+point can replace one and keep the rest. Results are cached by PDF content,
+and the number of files in flight is capped per process.
+"""
+import os
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, List, Optional
+
+import pandas as pd
+
+from invoice_extraction.compaction import compact_invoice_text
+from invoice_extraction.llm import LLM_MODEL, batcher, get_fields_from_llm, llm_router, reextract_fields
+from invoice_extraction.metrics import FILES, IN_FLIGHT
+from invoice_extraction.pdf_pool import ParsedPdf, get_pool
+from invoice_extraction.prompts import FIELDS, PROMPT_VERSION
+from invoice_extraction.result_cache import ExtractionCache, cache_key
+from invoice_extraction.rules import extract_fields
+from invoice_extraction.schema import NOT_AVAILABLE
+from invoice_extraction.templates import TemplateStore
+from invoice_extraction.tracing import stage, tracer
+from invoice_extraction.transform import transform_data
+from invoice_extraction.validation import consistency_errors
+
+logger = logging.getLogger(__name__)
+
+# Files extracted at once across this whole process
+MAX_CONCURRENT_FILES = int(os.getenv("MAX_CONCURRENT_FILES", "20"))
+
+# A stage reading fields without the LLM: (parsed PDF, fields still missing) -> {field: value}
+PreExtractor = Callable[[ParsedPdf, List[str]], Awaitable[dict]]
+
+
+async def parse_pdf(data: bytes) -> ParsedPdf:
+    """Parses PDF bytes in the PDF worker pool."""
+    return await get_pool().parse_async(data)
+
+
+async def qr_fields(parsed: ParsedPdf, fields: List[str]) -> dict:
+    """Reads fields from the signed e-invoice QR code."""
+    return {field: value for field, value in parsed.qr_fields.items() if field in fields}
+
+
+async def rule_fields(parsed: ParsedPdf, fields: List[str]) -> dict:
+    """Reads fields with the local regex rules."""
+    return {field: value for field, value in extract_fields(parsed.text).items() if field in fields}
+
+
+async def llm_fields(parsed: ParsedPdf, fields: List[str]) -> dict:
+    """Asks the LLM for the given fields, sharing a request with other invoices when batching is on."""
+    prompt_text = compact_invoice_text(parsed.pages, fields, model=LLM_MODEL)
+    if batcher is not None:
+        llm_data = await batcher.extract(prompt_text, fields)
+    else:
+        llm_data = await get_fields_from_llm(prompt_text, fields)
+    return {field: llm_data.get(field, NOT_AVAILABLE) for field in fields}
+
+
+async def recheck_fields(parsed: ParsedPdf, data: dict, errors: dict) -> dict:
+    """Returns corrections for the fields implicated in a failed checksum, format or arithmetic check.
+
+    They are asked again of the main model, once and for those fields only.
+    """
+    prompt_text = compact_invoice_text(parsed.pages, list(errors), model=LLM_MODEL)
+    return await reextract_fields(prompt_text, data, errors)
+
+
+def nothing_extracted(data: dict) -> bool:
+    """Returns whether every field of an extraction came back N/A, so the file counts as skipped."""
+    return all(value == NOT_AVAILABLE for value in data.values())
+
+
+def report_flagged_rows(rows: List[dict]):
+    """Logs the rows of a batch that still fail a consistency check after re-extraction."""
+    for index, row in enumerate(rows):
+        errors = consistency_errors(row)
+        if errors:
+            logger.warning("Row %s still fails validation: %s", index, errors)
+
+
+class ExtractionPipeline:
+    """Extracts invoice fields from PDF bytes and turns the results into export rows."""
+
+    def __init__(self, parse: Callable[[bytes], Awaitable[ParsedPdf]] = parse_pdf,
+                 pre_extractors: Optional[List[PreExtractor]] = None,
+                 llm: PreExtractor = llm_fields,
+                 validate: Callable[[ParsedPdf, dict, dict], Awaitable[dict]] = recheck_fields,
+                 transform: Callable[[pd.DataFrame], pd.DataFrame] = transform_data,
+                 cache: Optional[ExtractionCache] = None, templates: Optional[TemplateStore] = None,
+                 max_concurrent_files: int = MAX_CONCURRENT_FILES):
+        # Extraction results keyed by PDF content, so re-uploads skip parsing and the LLM entirely
+        self.cache = cache if cache is not None else ExtractionCache()
+        # Field positions learned per vendor layout, used to read fields without the LLM once confirmed
+        self.templates = templates if templates is not None else TemplateStore()
+        # Fields from the signed e-invoice QR code win, then local rules, then confirmed
+        # vendor layout templates; the LLM is only asked for the rest
+        self.pre_extractors = pre_extractors if pre_extractors is not None else [qr_fields, rule_fields, self.template_fields]
+        self._parse = parse
+        self._llm = llm
+        self._validate = validate
+        self._transform = transform
+        # Cached results are only reused while the prompt and models stay the same
+        self.version = ":".join(filter(None, [PROMPT_VERSION, llm_router.fast_model, LLM_MODEL]))
+        self._semaphore = asyncio.Semaphore(max_concurrent_files)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    async def template_fields(self, parsed: ParsedPdf, fields: List[str]) -> dict:
+        """Reads fields at the positions of this layout's confirmed template."""
+        return await asyncio.to_thread(self.templates.extract, parsed.words, fields)
+
+    async def extract(self, data: bytes, filename: str = "") -> dict:
+        """Extracts structured data from one PDF's bytes."""
+        with IN_FLIGHT.labels("files").track_inprogress(), \
+                tracer.start_as_current_span("extract_file", attributes={"file.name": filename, "file.bytes": len(data)}) as span:
+            try:
+                extracted_data, cached = await self._extract(data, filename)
+            except Exception:
+                FILES.labels("failed").inc()
+                raise
+            span.set_attribute("file.cached", cached)
+        if cached:
+            FILES.labels("cached").inc()
+        elif nothing_extracted(extracted_data):
+            FILES.labels("skipped").inc()
+        else:
+            FILES.labels("processed").inc()
+        return extracted_data
+
+    async def _extract(self, data: bytes, filename: str):
+        """Returns the extracted data, and whether it came from the cache."""
+        async with self._semaphore:
+            key = cache_key(data, self.version)
+            with stage("cache"):
+                cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.debug("Using cached result for %s", filename)
+                return cached, True
+
+            with stage("parse") as span:
+                parsed = await self._parse(data)
+                span.set_attributes({"pdf.pages": len(parsed.pages), "pdf.text_length": len(parsed.text)})
+            extracted_data, qr_data, template_data = {}, {}, {}
+            with stage("pre_extract") as span:
+                for pre_extractor in self.pre_extractors:
+                    missing_fields = [field for field in FIELDS if field not in extracted_data]
+                    if not missing_fields:
+                        break
+                    found = await pre_extractor(parsed, missing_fields)
+                    extracted_data.update(found)
+                    if pre_extractor == qr_fields:
+                        qr_data = found
+                    elif pre_extractor == self.template_fields:
+                        template_data = found
+                span.set_attribute("fields.found", len(extracted_data))
+
+            missing_fields = [field for field in FIELDS if field not in extracted_data]
+            if missing_fields:
+                with stage("llm", **{"fields.requested": len(missing_fields)}):
+                    extracted_data.update(await self._llm(parsed, missing_fields))
+            # Every field but the signed QR code's is checked, since rules and templates misread too
+            with stage("validate"):
+                errors = {field: error for field, error in consistency_errors(extracted_data).items() if field not in qr_data}
+                if errors:
+                    if llm_router.fast_model and any(field in missing_fields for field in errors):
+                        llm_router.record_escalation()
+                    extracted_data.update(await self._validate(parsed, extracted_data, errors))
+            failed_template_fields = [field for field in errors if field in template_data]
+            corrected_fields = [field for field in failed_template_fields if extracted_data[field] != template_data[field]]
+
+        # Values that didn't come from a template, or replaced a template value that failed a check,
+        # teach or confirm this layout's template; the failed positions lose their confirmations
+        with stage("learn"):
+            observed = {
+                field: value for field, value in extracted_data.items()
+                if field not in template_data or field in corrected_fields
+            }
+            await asyncio.to_thread(self.templates.observe, parsed.words, observed, failed_template_fields)
+            await asyncio.to_thread(self.cache.set, key, extracted_data)
+        return extracted_data, False
+
+    def extract_sync(self, data: bytes, filename: str = "") -> dict:
+        """Runs extract() from synchronous code, e.g. Streamlit, on the pipeline's own event loop thread.
+
+        Safe to call from several threads at once; the files then share the
+        loop, and with it the concurrency caps, rate limiter and batcher.
+        """
+        return asyncio.run_coroutine_threadsafe(self.extract(data, filename), self._background_loop()).result()
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="extraction-pipeline", daemon=True).start()
+            return self._loop
+
+    def transform(self, rows: List[dict]) -> pd.DataFrame:
+        """Turns extracted rows into the export format, logging rows that still fail a check."""
+        with stage("transform", rows=len(rows)):
+            report_flagged_rows(rows)
+            return self._transform(pd.DataFrame(rows))
@@ -0,0 +1,113 @@
+"""Prompts sent to the LLM, and the fields and guidelines they ask for."""
+import json
+from typing import List
+
+from invoice_extraction.batching import BatchItem
+
+# Bump whenever a prompt changes so cached results from the old prompt are no longer used
+PROMPT_VERSION = "5"
+
+# Fields the LLM is asked to extract from every invoice
+FIELDS = [
+    "Buyer's Order No.",
+    "Quantity",
+    "Rate",
+    "Basic amount without tax",
+    "IGST",
+    "Total Amount",
+    "InvoiceNo",
+    "Ack Date",
+    "GSTIN Number",
+    "TML GSTIN",
+    "IRN",
+]
+
+# Extraction guidelines, each included in the prompt only when one of its fields is requested
+GUIDELINES = [
+    (("Quantity", "Rate", "Basic amount without tax", "Total Amount"), '"Quantity", "Rate", "Basic amount without tax", and "Total Amount" are usually found within the table describing the goods.'),
+    (("Quantity", "Rate"), 'For "Quantity" and "Rate", extract only the integer value. For example, if the quantity is "5 Nos", the value should be 5.'),
+    (("InvoiceNo",), 'For "InvoiceNo", look for a label like "Invoice No.". The value can be alphanumeric with slashes, like "SW/25-26/2513".'),
+    (("Ack Date",), 'For "Ack Date", look for a label like "Dated" or "Ack Date".'),
+    (("IGST",), 'For "IGST", find the value for IGST tax. It might be under a description of taxes.'),
+    (("GSTIN Number",), 'For "GSTIN Number", this is the GSTIN for the "Sunrise Wheels".'),
+    (("TML GSTIN",), 'For "TML GSTIN", this is the GSTIN for the "Buyer" or "Bill to" party.'),
+]
+
+
+def format_guidelines(fields: List[str]) -> str:
+    return "\n".join(
+        f"    - {guideline}" for guideline_fields, guideline in GUIDELINES
+        if any(field in fields for field in guideline_fields)
+    )
+
+
+def build_prompt(text: str, fields: List[str]) -> str:
+    """Builds the extraction prompt asking for the given fields only."""
+    fields_list = "\n".join(f'    - "{field}"' for field in fields)
+    guidelines = format_guidelines(fields)
+    return f"""
+    You are an expert data extractor. From the following invoice text, extract the specified fields and return the data in a clean JSON format.
+    If a field is not present, its value should be "N/A".
+
+    The JSON keys should be exactly as specified in the "Fields to Extract" list.
+
+    **Fields to Extract:**
+{fields_list}
+
+    **Extraction Guidelines:**
+{guidelines}
+
+    **Invoice Text:**
+    ---
+    {text}
+    ---
+    """
+
+
+def build_batch_prompt(items: List[BatchItem]) -> str:
+    """Builds one prompt asking for the requested fields of several invoices at once."""
+    all_fields = [field for field in FIELDS if any(field in item.fields for item in items)]
+    invoices = "\n".join(
+        f"""
+    **Invoice "{item.file_id}"**
+    Fields to Extract: {", ".join(f'"{field}"' for field in item.fields)}
+    ---
+    {item.text}
+    ---"""
+        for item in items
+    )
+    return f"""
+    You are an expert data extractor. Below are the texts of {len(items)} separate invoices. From each invoice, extract the fields listed for it.
+    If a field is not present, its value should be "N/A".
+
+    Return an "invoices" array containing one object per invoice.
+    Each object must have a "file_id" key with the invoice's id, plus the invoice's fields with keys exactly as listed.
+    Fields not listed for an invoice should be "N/A".
+
+    **Extraction Guidelines:**
+{format_guidelines(all_fields)}
+{invoices}
+    """
+
+
+def build_repair_prompt(text: str, answer: dict, errors: dict) -> str:
+    """Builds a prompt asking again for only the fields whose previous values failed validation."""
+    rejected = "\n".join(
+        f'    - "{field}": previous value {json.dumps(answer.get(field)) if field in answer else "missing"} was rejected ({error})'
+        for field, error in errors.items()
+    )
+    return f"""
+    You are an expert data extractor. Some fields previously extracted from the following invoice text were invalid.
+    Extract only these fields again. If a field is not present, its value should be "N/A".
+
+    **Fields to Correct:**
+{rejected}
+
+    **Extraction Guidelines:**
+{format_guidelines(list(errors))}
+
+    **Invoice Text:**
+    ---
+    {text}
+    ---
+    """
@@ -0,0 +1,104 @@
+"""Decoding of the signed GST e-invoice QR code.
+
+The QR code on an e-invoice holds a JWT signed by the Invoice Registration
+Portal whose payload carries the IRN, seller and buyer GSTINs, document number,
+date and total value, so those fields can be read without any LLM call. The
+signature is not verified here; the payload is only used to fill fields.
+"""
+import os
+import re
+import json
+import base64
+import logging
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # QR decoding is optional; without OpenCV the stage is skipped
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+# Render resolution (DPI) for QR regions; dense e-invoice codes need a few pixels per module to decode
+QR_RESOLUTION = int(os.getenv("QR_RESOLUTION", "200"))
+
+# Text that marks a page as an e-invoice, whose QR code is worth looking for on the whole page
+E_INVOICE_MARKERS = re.compile(r"\bIRN\b|\bAck\.?\s*No\b", re.IGNORECASE)
+
+# Payload keys of the signed QR mapped to the LLM prompt's field names
+QR_FIELDS = {
+    "Irn": "IRN",
+    "SellerGstin": "GSTIN Number",
+    "BuyerGstin": "TML GSTIN",
+    "DocNo": "InvoiceNo",
+    "DocDt": "Ack Date",
+    "TotInvVal": "Total Amount",
+}
+
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def parse_signed_qr(token: str) -> dict:
+    """Parses the JWT from an e-invoice QR code into prompt fields, or returns {} if it isn't one."""
+    parts = token.strip().split(".")
+    if len(parts) != 3:
+        return {}
+    try:
+        payload = json.loads(_b64url_decode(parts[1]))
+        data = payload.get("data", payload)
+        if isinstance(data, str):
+            data = json.loads(data)
+    except (ValueError, AttributeError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {field: data[key] for key, field in QR_FIELDS.items() if data.get(key) not in (None, "")}
+
+
+def _candidate_regions(page, text: str):
+    """Yields bounding boxes of square-ish embedded images that may be the QR code, then the whole page.
+
+    The whole page, which costs several times the parse itself to render and
+    scan, is only tried when its text shows e-invoice markers.
+    """
+    for image in page.images:
+        width, height = image["x1"] - image["x0"], image["bottom"] - image["top"]
+        if width >= 40 and height >= 40 and 0.8 <= width / height <= 1.25:
+            pad = 6
+            yield (
+                max(image["x0"] - pad, 0),
+                max(image["top"] - pad, 0),
+                min(image["x1"] + pad, page.width),
+                min(image["bottom"] + pad, page.height),
+            )
+    if E_INVOICE_MARKERS.search(text):
+        yield None
+
+
+def _decode_image(image) -> list:
+    rgb = np.array(image.convert("RGB"))
+    # The ArUco-based detector (OpenCV 4.8+) copes far better with dense, high-version codes
+    detector = cv2.QRCodeDetectorAruco() if hasattr(cv2, "QRCodeDetectorAruco") else cv2.QRCodeDetector()
+    ok, texts, _, _ = detector.detectAndDecodeMulti(rgb)
+    return [text for text in texts if text] if ok else []
+
+
+def decode_qr_fields(page, text: str) -> dict:
+    """Renders the QR region of a pdfplumber page and returns the prompt fields from its signed payload."""
+    if cv2 is None:
+        return {}
+    for bbox in _candidate_regions(page, text):
+        region = page.crop(bbox) if bbox else page
+        try:
+            image = region.to_image(resolution=QR_RESOLUTION).original
+            texts = _decode_image(image)
+        except Exception as e:
+            logger.warning("QR decoding failed: %s", e)
+            continue
+        for text in texts:
+            fields = parse_signed_qr(text)
+            if fields:
+                return fields
+    return {}
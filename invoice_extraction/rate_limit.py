@@ -0,0 +1,121 @@
+"""Client-side rate limiting of OpenAI calls.
+
+Requests-per-minute and tokens-per-minute budgets are kept as token buckets in
+a local SQLite file, so every uvicorn worker process on the host draws from the
+same budget. Calls that don't fit wait their turn instead of hitting the
+provider's 429s.
+"""
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Provider limits for the account/model, and the shared bucket store
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "rate_limits.sqlite3")
+
+# Longest single sleep while waiting, so a refund from another worker is noticed promptly
+MAX_POLL_INTERVAL = 1.0
+
+
+class RateLimitScheduler:
+    """Token buckets for requests and tokens per minute, shared across processes through SQLite."""
+
+    def __init__(self, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE, path: str = RATE_LIMIT_DB_PATH):
+        self.capacity = {"requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self.path = path
+        # Calls in this process waiting for budget; asyncio.Lock is FIFO, so they are served in arrival order
+        self.queue_depth = 0
+        self._turn = asyncio.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _levels(self, conn: sqlite3.Connection, now: float) -> dict:
+        """Returns the current bucket levels, refilled for the time since they were last updated."""
+        rows = dict((name, (level, updated_at)) for name, level, updated_at in conn.execute("SELECT * FROM buckets"))
+        levels = {}
+        for name, capacity in self.capacity.items():
+            level, updated_at = rows.get(name, (capacity, now))
+            levels[name] = min(capacity, level + (now - updated_at) * capacity / 60)
+        return levels
+
+    def _save(self, conn: sqlite3.Connection, levels: dict, now: float):
+        conn.executemany(
+            "INSERT OR REPLACE INTO buckets (name, level, updated_at) VALUES (?, ?, ?)",
+            [(name, level, now) for name, level in levels.items()],
+        )
+
+    def try_acquire(self, tokens: int) -> float:
+        """Takes one request and the given tokens if both fit; otherwise returns the seconds to wait."""
+        need = {"requests": 1.0, "tokens": float(min(tokens, self.capacity["tokens"]))}
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            levels = self._levels(conn, now)
+            shortfalls = [
+                (need[name] - levels[name]) * 60 / self.capacity[name]
+                for name in need if levels[name] < need[name]
+            ]
+            if shortfalls:
+                return max(shortfalls)
+            for name in need:
+                levels[name] -= need[name]
+            self._save(conn, levels, now)
+        return 0.0
+
+    async def acquire(self, tokens: int):
+        """Waits until the call fits in both budgets, then takes it."""
+        self.queue_depth += 1
+        try:
+            async with self._turn:
+                while True:
+                    wait = await asyncio.to_thread(self.try_acquire, tokens)
+                    if wait == 0.0:
+                        return
+                    await asyncio.sleep(min(wait, MAX_POLL_INTERVAL))
+        finally:
+            self.queue_depth -= 1
+
+    def _adjust(self, name: str, delta: float, floor: float = None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            levels = self._levels(conn, now)
+            levels[name] = min(self.capacity[name], levels[name] + delta)
+            if floor is not None:
+                levels[name] = max(floor, levels[name])
+            self._save(conn, levels, now)
+
+    async def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        """Corrects the token bucket once a response reports the tokens the call really used."""
+        if actual_tokens is not None and actual_tokens != estimated_tokens:
+            await asyncio.to_thread(self._adjust, "tokens", estimated_tokens - actual_tokens)
+
+    async def back_off(self):
+        """Empties the token bucket after the provider returned a 429, so every worker pauses."""
+        await asyncio.to_thread(self._adjust, "tokens", -self.capacity["tokens"], 0.0)
+        logger.warning("OpenAI rate limit hit; pausing LLM calls on all workers")
+
+    def status(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "requests_per_minute": self.capacity["requests"],
+            "tokens_per_minute": self.capacity["tokens"],
+        }
@@ -0,0 +1,165 @@
+"""Resilient calling of the LLM: per-attempt timeouts, jittered retries, hedging and request deadlines.
+
+A deadline set with request_deadline() for an incoming request applies to
+every LLM call made while serving it (contextvars follow the tasks it
+spawns), so retries and waits never run past the time the client has.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+# Seconds per attempt, attempts per call, and backoff base/cap in seconds
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "60"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "8"))
+# Send a second, hedged request when the first is slower than this latency percentile (0 disables hedging)
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Successful latencies remembered per kind of call for its percentile, and how many are needed before hedging starts
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the request's deadline leaves no time for another LLM attempt."""
+
+
+@contextmanager
+def request_deadline(seconds: float):
+    """Sets the deadline for all LLM calls made within the block, including from tasks it starts."""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """Returns the seconds left before the current deadline, or None if there is none."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+class ResilientCaller:
+    """Runs an LLM request with retries on transient errors, hedging of slow attempts, and deadlines."""
+
+    def __init__(self, attempt_timeout: float = LLM_ATTEMPT_TIMEOUT, max_attempts: int = LLM_MAX_ATTEMPTS,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_cap: float = LLM_BACKOFF_CAP,
+                 hedge_percentile: float = LLM_HEDGE_PERCENTILE):
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_percentile = hedge_percentile
+        # Kept apart per model and call kind, so fast calls don't set the hedge delay of slow ones
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        # Counters for tuning the policy
+        self.retries = 0
+        self.hedges = 0
+
+    def hedge_delay(self, key=None):
+        """Returns the latency after which a hedged request of this kind is sent, or None if hedging is off."""
+        latencies = self.latencies[key]
+        if not self.hedge_percentile or len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return ordered[index]
+
+    def _timeout(self) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return self.attempt_timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded before the LLM call could be made")
+        return min(self.attempt_timeout, remaining)
+
+    async def _prepare(self, prepare):
+        """Waits in prepare(); the wait counts against the deadline but not the latency."""
+        if prepare is not None:
+            remaining = remaining_time()
+            await asyncio.wait_for(prepare(), remaining) if remaining is not None else await prepare()
+
+    async def _send(self, send, key):
+        timeout = self._timeout()
+        started = time.monotonic()
+        result = await asyncio.wait_for(send(timeout), timeout)
+        self.latencies[key].append(time.monotonic() - started)
+        return result
+
+    async def _attempt(self, send, prepare, key):
+        await self._prepare(prepare)
+        return await self._send(send, key)
+
+    async def _hedged(self, send, prepare, key):
+        # The hedge clock starts once the first attempt has its budget, so time queued never triggers a hedge
+        await self._prepare(prepare)
+        tasks = {asyncio.create_task(self._send(send, key))}
+        try:
+            delay = self.hedge_delay(key)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.hedges += 1
+                    logger.info("LLM call slower than p%g (%.1fs); sending a hedged request", self.hedge_percentile, delay)
+                    tasks.add(asyncio.create_task(self._attempt(send, prepare, key)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, send, prepare=None, key=None):
+        """Calls send(timeout) until it succeeds, retrying transient errors with jittered exponential backoff.
+
+        prepare(), if given, is awaited before every attempt (e.g. to wait for rate-limit budget).
+        key names the kind of call (e.g. model and prompt type) whose latencies set its hedge delay.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await self._hedged(send, prepare, key)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_attempts:
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    raise DeadlineExceeded(f"Request deadline exceeded while retrying the LLM call: {str(e) or type(e).__name__}") from e
+                self.retries += 1
+                logger.warning("LLM attempt %d failed (%s); retrying in %.2fs", attempt, e, delay)
+                await asyncio.sleep(delay)
@@ -0,0 +1,83 @@
+"""Tiered model routing: a fast, cheap model first, the main model only when its answer fails the checks.
+
+Per-tier call counts, latency, tokens and estimated cost are kept so the
+escalation rate and savings can be watched while tuning the policy.
+"""
+import os
+import json
+import threading
+from dataclasses import dataclass
+
+# Model tried first; unset sends everything straight to the main model
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "")
+
+# USD per 1K prompt and completion tokens, for the cost estimates; override with LLM_PRICES='{"model": [in, out]}'
+LLM_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    **{model: tuple(prices) for model, prices in json.loads(os.getenv("LLM_PRICES", "{}")).items()},
+}
+
+
+@dataclass
+class TierMetrics:
+    """Running totals of one model tier's calls."""
+    calls: int = 0
+    escalations: int = 0
+    latency_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "escalations": self.escalations,
+            "avg_latency_seconds": round(self.latency_seconds / self.calls, 3) if self.calls else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 4),
+        }
+
+
+class TierRouter:
+    """Picks the model for each call and records per-tier metrics."""
+
+    def __init__(self, main_model: str, fast_model: str = LLM_FAST_MODEL):
+        self.main_model = main_model
+        self.fast_model = fast_model if fast_model and fast_model != main_model else None
+        self.tiers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def first_model(self) -> str:
+        return self.fast_model or self.main_model
+
+    def _tier(self, model: str) -> TierMetrics:
+        return self.tiers.setdefault(model, TierMetrics())
+
+    def record(self, model: str, latency: float, usage=None):
+        """Records one call's latency and, if the response reported it, its token usage and cost."""
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        input_price, output_price = LLM_PRICES.get(model, (0.0, 0.0))
+        with self._lock:
+            tier = self._tier(model)
+            tier.calls += 1
+            tier.latency_seconds += latency
+            tier.prompt_tokens += prompt_tokens
+            tier.completion_tokens += completion_tokens
+            tier.cost_usd += (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+
+    def record_escalation(self):
+        """Counts an invoice whose fast-tier answer was sent on to the main model."""
+        with self._lock:
+            self._tier(self.first_model).escalations += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            tiers = {model: tier.as_dict() for model, tier in self.tiers.items()}
+        return {"fast_model": self.fast_model, "main_model": self.main_model, "tiers": tiers}
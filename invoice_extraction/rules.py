@@ -0,0 +1,77 @@
+"""Deterministic rule-based extraction of well-structured invoice fields.
+
+Fields with a fixed machine format (IRN, GSTINs, Sunrise Wheels invoice
+numbers, acknowledgement dates) are found with regular expressions so the LLM
+only has to be asked for what these rules couldn't resolve.
+"""
+import re
+
+# 64 hex characters; pdfplumber may wrap a long IRN across lines, so whitespace and hyphens are allowed in between
+IRN_LABELLED = re.compile(r"\bIRN\b\s*[:\-]?\s*((?:[0-9a-f][\s\-]*){64})", re.IGNORECASE)
+IRN_PLAIN = re.compile(r"\b[0-9a-f]{64}\b", re.IGNORECASE)
+
+# 2-digit state code, 10-char PAN, entity number, 'Z', check character
+GSTIN = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b")
+# "Buyer's Order No." sits in the header next to the seller's details, so it must not count as the buyer block
+BUYER_LABEL = re.compile(r"\b(?:Buyer(?!['\u2019]s)|Bill\s*to)\b", re.IGNORECASE)
+
+# Sunrise Wheels numbering: series / financial year / sequence, e.g. "SW/25-26/2513"
+INVOICE_NO = re.compile(r"\b[A-Z]{1,6}/\d{2}-\d{2}/\d{1,6}\b")
+
+DATE = r"\d{1,2}[-/. ](?:\d{1,2}|[A-Za-z]{3,9})[-/. ]\d{2,4}"
+ACK_DATE = re.compile(r"\bAck\.?\s*Date\s*[:\-]?\s*(" + DATE + r")", re.IGNORECASE)
+DATED = re.compile(r"\bDated\s*[:\-]?\s*(" + DATE + r")", re.IGNORECASE)
+
+RULE_FIELDS = ("IRN", "GSTIN Number", "TML GSTIN", "InvoiceNo", "Ack Date")
+
+
+def _unique(values):
+    """Returns the single distinct value in values, or None if there are none or they disagree."""
+    distinct = set(values)
+    return distinct.pop() if len(distinct) == 1 else None
+
+
+def find_irn(text: str):
+    match = IRN_LABELLED.search(text)
+    if match:
+        return re.sub(r"[\s\-]", "", match.group(1)).lower()
+    return _unique(value.lower() for value in IRN_PLAIN.findall(text))
+
+
+def find_gstins(text: str):
+    """Returns (seller GSTIN, buyer GSTIN) split around the first "Buyer"/"Bill to" label."""
+    label = BUYER_LABEL.search(text)
+    if label is None:
+        return None, None
+    seller = GSTIN.search(text, 0, label.start())
+    buyer = GSTIN.search(text, label.end())
+    seller = seller.group(0) if seller else None
+    buyer = buyer.group(0) if buyer else None
+    if seller == buyer:
+        return None, None
+    return seller, buyer
+
+
+def find_invoice_no(text: str):
+    return _unique(INVOICE_NO.findall(text))
+
+
+def find_ack_date(text: str):
+    match = ACK_DATE.search(text) or DATED.search(text)
+    return match.group(1) if match else None
+
+
+def extract_fields(text: str) -> dict:
+    """Returns the rule-resolved fields found in text, keyed by the LLM prompt's field names.
+
+    Fields the rules can't resolve unambiguously are left out.
+    """
+    seller_gstin, buyer_gstin = find_gstins(text)
+    found = {
+        "IRN": find_irn(text),
+        "GSTIN Number": seller_gstin,
+        "TML GSTIN": buyer_gstin,
+        "InvoiceNo": find_invoice_no(text),
+        "Ack Date": find_ack_date(text),
+    }
+    return {field: value for field, value in found.items() if value}
@@ -0,0 +1,117 @@
+"""Typed schema and validation for the fields extracted by the LLM.
+
+The schema is sent as the parameters of a forced tool call, so answers come
+back as JSON arguments instead of free text; validate_fields then checks
+every value so only the invalid ones need a repair call.
+"""
+import re
+
+NOT_AVAILABLE = "N/A"
+
+GSTIN_PATTERN = r"^\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]$"
+IRN_PATTERN = r"^[0-9a-f]{64}$"
+
+# Type of each prompt field
+FIELD_TYPES = {
+    "Buyer's Order No.": "string",
+    "Quantity": "integer",
+    "Rate": "number",
+    "Basic amount without tax": "number",
+    "IGST": "number",
+    "Total Amount": "number",
+    "InvoiceNo": "string",
+    "Ack Date": "string",
+    "GSTIN Number": "gstin",
+    "TML GSTIN": "gstin",
+    "IRN": "irn",
+}
+
+_NOT_AVAILABLE_SCHEMA = {"type": "string", "enum": [NOT_AVAILABLE]}
+
+
+def field_schema(field: str) -> dict:
+    """Returns the JSON schema of one field; every field may also be "N/A"."""
+    kind = FIELD_TYPES.get(field, "string")
+    if kind in ("integer", "number"):
+        return {"anyOf": [{"type": kind}, _NOT_AVAILABLE_SCHEMA]}
+    if kind == "gstin":
+        return {"anyOf": [{"type": "string", "pattern": GSTIN_PATTERN}, _NOT_AVAILABLE_SCHEMA]}
+    if kind == "irn":
+        return {"anyOf": [{"type": "string", "pattern": IRN_PATTERN}, _NOT_AVAILABLE_SCHEMA]}
+    return {"type": "string"}
+
+
+def invoice_schema(fields: list) -> dict:
+    """Returns the schema of an object holding the given fields."""
+    return {
+        "type": "object",
+        "properties": {field: field_schema(field) for field in fields},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+
+
+def batch_schema(fields: list) -> dict:
+    """Returns the schema of {"invoices": [...]} holding the given fields for several invoices."""
+    item = invoice_schema(fields)
+    item["properties"] = {"file_id": {"type": "string"}, **item["properties"]}
+    item["required"] = ["file_id", *item["required"]]
+    return {
+        "type": "object",
+        "properties": {"invoices": {"type": "array", "items": item}},
+        "required": ["invoices"],
+        "additionalProperties": False,
+    }
+
+
+def _validate(kind: str, value):
+    """Returns (normalized value, None) or (None, error message) for one value."""
+    if value == NOT_AVAILABLE:
+        return value, None
+    if kind in ("integer", "number"):
+        if isinstance(value, str):
+            # Amounts often come back formatted, e.g. "6,000.00"
+            try:
+                value = float(value.replace(",", "").strip())
+            except ValueError:
+                return None, f'expected a {kind} or "N/A", got {value!r}'
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None, f'expected a {kind} or "N/A", got {value!r}'
+        if kind == "integer":
+            if float(value) != int(value):
+                return None, f"expected an integer, got {value!r}"
+            return int(value), None
+        return (int(value) if float(value).is_integer() else value), None
+    if not isinstance(value, str) or not value.strip():
+        return None, f'expected a non-empty string or "N/A", got {value!r}'
+    value = value.strip()
+    if kind == "gstin" and not re.match(GSTIN_PATTERN, value.upper()):
+        return None, f"{value!r} is not a 15-character GSTIN"
+    if kind == "gstin":
+        return value.upper(), None
+    if kind == "irn" and not re.match(IRN_PATTERN, value.lower()):
+        return None, f"{value!r} is not a 64-character hexadecimal IRN"
+    if kind == "irn":
+        return value.lower(), None
+    return value, None
+
+
+def validate_fields(data, fields: list):
+    """Checks an LLM answer against the schema.
+
+    Returns (valid, errors): the normalized values of the valid fields, and an
+    error message for every requested field that is missing or invalid.
+    """
+    if not isinstance(data, dict):
+        data = {}
+    valid, errors = {}, {}
+    for field in fields:
+        if field not in data:
+            errors[field] = "missing"
+            continue
+        value, error = _validate(FIELD_TYPES.get(field, "string"), data[field])
+        if error:
+            errors[field] = error
+        else:
+            valid[field] = value
+    return valid, errors
@@ -0,0 +1,234 @@
+"""Per-vendor layout templates learned from past extractions.
+
+Each successful extraction records, for every field, where its value sat on
+the first page relative to a nearby label word. Once a layout has reproduced a
+field's value on enough later invoices, that field is read straight from the
+word coordinates of new PDFs with a matching layout fingerprint instead of
+asking the LLM.
+"""
+import os
+import re
+import json
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Template store, minimum layout similarity to reuse a template, and matches needed before a field is trusted
+TEMPLATE_DB_PATH = os.getenv("TEMPLATE_DB_PATH", "layout_templates.sqlite3")
+TEMPLATE_MATCH_THRESHOLD = float(os.getenv("TEMPLATE_MATCH_THRESHOLD", "0.6"))
+TEMPLATE_CONFIRMATIONS = int(os.getenv("TEMPLATE_CONFIRMATIONS", "2"))
+
+# Positions are compared on a grid of this many points so small rendering differences don't matter
+GRID = 5
+# How far (in points) a value or anchor may drift from its learned position and still be found
+LINE_TOLERANCE = 3
+ANCHOR_SEARCH_RADIUS = 60
+# Values spanning more words than this (e.g. "12 Apr 2025") aren't learned
+MAX_VALUE_WORDS = 3
+
+LABEL_WORD = re.compile(r"^[A-Za-z][A-Za-z.'/&()-]*:?$")
+
+
+def layout_fingerprint(words: list) -> set:
+    """Returns the set of label words and their grid positions, which identifies a layout."""
+    return {
+        f"{word['text']}@{round(word['x0'] / GRID)},{round(word['top'] / GRID)}"
+        for word in words if LABEL_WORD.match(word["text"])
+    }
+
+
+def similarity(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def _normalize(value):
+    """Normalizes a value for comparison: amounts become floats, everything else an upper-case string."""
+    text = str(value).strip()
+    number = text.replace(",", "").replace("₹", "").strip()
+    try:
+        return float(number)
+    except ValueError:
+        return re.sub(r"\s+", " ", text).upper()
+
+
+def _line_runs(words: list):
+    """Yields (start index, run of 1..MAX_VALUE_WORDS consecutive words on the same line)."""
+    for i in range(len(words)):
+        run = [words[i]]
+        yield i, run
+        for word in words[i + 1:i + MAX_VALUE_WORDS]:
+            if abs(word["top"] - run[0]["top"]) > LINE_TOLERANCE:
+                break
+            run = run + [word]
+            yield i, run
+
+
+def _find_anchor(words: list, index: int):
+    """Returns the nearest label word left of, or else just above, the word at index."""
+    value = words[index]
+    left = [
+        word for word in words[:index]
+        if LABEL_WORD.match(word["text"]) and abs(word["top"] - value["top"]) <= LINE_TOLERANCE
+        and word["x1"] <= value["x0"]
+    ]
+    if left:
+        return max(left, key=lambda word: word["x1"])
+    above = [
+        word for word in words
+        if LABEL_WORD.match(word["text"]) and 0 < value["top"] - word["top"] <= ANCHOR_SEARCH_RADIUS
+        and word["x0"] < value["x1"] and word["x1"] > value["x0"]
+    ]
+    if above:
+        return max(above, key=lambda word: word["top"])
+    return None
+
+
+def learn_position(words: list, value):
+    """Locates a field value among the words and returns its position relative to an anchor label.
+
+    Returns None when the value isn't on the page or appears more than once.
+    """
+    target = _normalize(value)
+    matches = [
+        (index, run) for index, run in _line_runs(words)
+        if _normalize(" ".join(word["text"] for word in run)) == target
+    ]
+    if len(matches) != 1:
+        return None
+    index, run = matches[0]
+    anchor = _find_anchor(words, index)
+    if anchor is None:
+        return None
+    return {
+        "anchor": anchor["text"],
+        "anchor_x0": anchor["x0"],
+        "anchor_top": anchor["top"],
+        "dx": run[0]["x0"] - anchor["x0"],
+        "dy": run[0]["top"] - anchor["top"],
+        "n_words": len(run),
+        # Only values the LLM gave as numbers are read back as numbers, so IDs keep their leading zeros
+        "numeric": isinstance(value, (int, float)) and isinstance(target, float),
+    }
+
+
+def read_position(words: list, position: dict):
+    """Reads a field value from the words using a learned position, or returns None if it isn't there."""
+    anchors = [
+        word for word in words
+        if word["text"] == position["anchor"]
+        and abs(word["x0"] - position["anchor_x0"]) <= ANCHOR_SEARCH_RADIUS
+        and abs(word["top"] - position["anchor_top"]) <= ANCHOR_SEARCH_RADIUS
+    ]
+    if not anchors:
+        return None
+    anchor = min(anchors, key=lambda word: abs(word["x0"] - position["anchor_x0"]) + abs(word["top"] - position["anchor_top"]))
+    x0, top = anchor["x0"] + position["dx"], anchor["top"] + position["dy"]
+    line = sorted(
+        (word for word in words if abs(word["top"] - top) <= LINE_TOLERANCE and word["x0"] >= x0 - GRID),
+        key=lambda word: word["x0"],
+    )
+    if not line or abs(line[0]["x0"] - x0) > GRID:
+        return None
+    text = " ".join(word["text"] for word in line[:position["n_words"]])
+    value = _normalize(text)
+    if position["numeric"]:
+        if not isinstance(value, float):
+            return None
+        return int(value) if value.is_integer() else value
+    return text
+
+
+class TemplateStore:
+    """SQLite-backed collection of learned layout templates."""
+
+    def __init__(self, path: str = TEMPLATE_DB_PATH, threshold: float = TEMPLATE_MATCH_THRESHOLD,
+                 confirmations: int = TEMPLATE_CONFIRMATIONS):
+        self.path = path
+        self.threshold = threshold
+        self.confirmations = confirmations
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS templates ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, fingerprint TEXT NOT NULL, fields TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _match(self, conn: sqlite3.Connection, fingerprint: set):
+        """Returns (id, fields) of the most similar stored template above the threshold, or None."""
+        best, best_score = None, self.threshold
+        for template_id, stored, fields in conn.execute("SELECT id, fingerprint, fields FROM templates"):
+            score = similarity(fingerprint, set(json.loads(stored)))
+            if score >= best_score:
+                best, best_score = (template_id, json.loads(fields)), score
+        return best
+
+    def extract(self, words: list, fields: list) -> dict:
+        """Reads the requested fields that a confirmed, matching template knows how to find."""
+        if not words:
+            return {}
+        with self._connect() as conn:
+            match = self._match(conn, layout_fingerprint(words))
+        if match is None:
+            return {}
+        _, positions = match
+        extracted = {}
+        for field in fields:
+            position = positions.get(field)
+            if position is None or position["hits"] < self.confirmations:
+                continue
+            value = read_position(words, position)
+            if value is not None:
+                extracted[field] = value
+        return extracted
+
+    def observe(self, words: list, values: dict, failed: list = ()):
+        """Learns from an extraction whose values came from the LLM, rules or QR code.
+
+        Fields whose learned position reproduces the value gain a confirmation;
+        fields that disagree are re-learned from this invoice. Fields in failed
+        were read from this template and failed a consistency check, so their
+        positions lose their confirmations first.
+        """
+        if not words:
+            return
+        fingerprint = layout_fingerprint(words)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            match = self._match(conn, fingerprint)
+            template_id, positions = match if match else (None, {})
+            for field in failed:
+                if field in positions:
+                    positions[field]["hits"] = 0
+            for field, value in values.items():
+                if value in (None, "", "N/A"):
+                    continue
+                position = positions.get(field)
+                current = read_position(words, position) if position is not None else None
+                if current is not None and _normalize(current) == _normalize(value):
+                    position["hits"] += 1
+                    continue
+                learned = learn_position(words, value)
+                if learned is not None:
+                    positions[field] = {**learned, "hits": 0}
+                elif position is not None:
+                    # A trusted position that no longer reproduces the value stops being used
+                    position["hits"] = 0
+            if template_id is None:
+                if positions:
+                    conn.execute(
+                        "INSERT INTO templates (fingerprint, fields) VALUES (?, ?)",
+                        (json.dumps(sorted(fingerprint)), json.dumps(positions)),
+                    )
+                    logger.info("Learned a new layout template for %d fields", len(positions))
+            else:
+                conn.execute("UPDATE templates SET fields = ? WHERE id = ?", (json.dumps(positions), template_id))
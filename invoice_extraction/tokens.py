@@ -0,0 +1,35 @@
+"""Local token counting for prompt budgeting."""
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English text, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:  # the BPE files are downloaded on first use, which fails offline
+        logger.warning("Tokenizer unavailable, estimating token counts: %s", e)
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Returns the number of tokens text takes for the given model."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,57 @@
+"""OpenTelemetry tracing of requests, files and pipeline stages.
+
+Each /api/extract request gets a span, with a child span per file and
+grandchildren per stage, annotated with page counts, text lengths, token
+counts and models. Spans are only recorded when TRACING_EXPORTER is set:
+"console", "file" (JSON lines appended to TRACING_FILE) or "otlp" (a local
+collector, configured through the standard OTEL_EXPORTER_OTLP_* variables;
+needs opentelemetry-exporter-otlp).
+"""
+import os
+import logging
+from contextlib import contextmanager
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+from invoice_extraction.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "invoice-extraction")
+
+
+def _exporter():
+    if TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if TRACING_EXPORTER == "file":
+        return ConsoleSpanExporter(out=open(TRACING_FILE, "a"), formatter=lambda span: span.to_json(indent=None) + "\n")
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    raise ValueError(f"Unknown TRACING_EXPORTER {TRACING_EXPORTER!r}; use console, file or otlp")
+
+
+def configure_tracing():
+    """Installs a tracer provider exporting to TRACING_EXPORTER; without one, spans are no-ops."""
+    if not TRACING_EXPORTER or TRACING_EXPORTER == "none":
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(_exporter()))
+    trace.set_tracer_provider(provider)
+    logger.info("Tracing to %s", TRACING_EXPORTER)
+
+
+configure_tracing()
+tracer = trace.get_tracer("invoice_extraction")
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Traces one pipeline stage as a span and records its duration in the stage histogram."""
+    with tracer.start_as_current_span(name, attributes=attributes) as span, time_stage(name):
+        yield span
@@ -0,0 +1,80 @@
+"""Conversion of extracted invoice fields into the rows of the final export.
+
+The export's columns are declared once in OUTPUT_COLUMNS, and the final
+frame is built from them in a single construction pass.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Column:
+    """One export column: the extracted field it comes from, or the value every row gets."""
+    target: str
+    source: Optional[str] = None
+    # Used for every row when there is no source, or the source field is missing from the whole batch
+    default: object = ""
+    # "number" columns become int/float when every value is numeric; otherwise (e.g. "N/A") they stay as extracted
+    dtype: str = "text"
+
+
+OUTPUT_COLUMNS = [
+    Column("PO NUMBER", "Buyer's Order No.", default=None),
+    Column("PO Item No"),
+    Column("Quantity", "Quantity", default=None, dtype="number"),
+    Column("VENDOR CHALLAN NO", "InvoiceNo", default=None),
+    Column("Challan Date", "Ack Date", default=None),
+    Column("Gross Rate", "Rate", default=None, dtype="number"),
+    Column("Net P O Rate", "Rate", default=None, dtype="number"),
+    Column("Basic Value", "Basic amount without tax", default=None, dtype="number"),
+    Column("Taxable Value", "Basic amount without tax", default=None, dtype="number"),
+    Column("SGST VALUE"),
+    Column("CGST VALUE"),
+    Column("IGST VALUE", "IGST", default=None, dtype="number"),
+    Column("SGST RATE"),
+    Column("CGST RATE"),
+    Column("IGST RATE"),
+    Column("Packing Amount"),
+    Column("Freight Amount"),
+    Column("Others Amount"),
+    Column("INVOICE VALUE", "Total Amount", default=None, dtype="number"),
+    Column("Currency", default="INR"),
+    Column("E Way Bill"),
+    Column("57F4 NUMBER"),
+    Column("57F4 NO DATE"),
+    Column("GSTIN Number", "GSTIN Number", default=None),
+    Column("Vehicle Number"),
+    Column("PART REV Level"),
+    Column("COP Certificate"),
+    Column("Certificate Date"),
+    Column("TML GSTIN", "TML GSTIN", default=None),
+    Column("Digital Invoice File Name"),
+    Column("IRN", "IRN", default=None),
+    Column("TCS Value"),
+    Column("Field4"),
+    Column("Field5"),
+]
+
+
+def _column_values(df: pd.DataFrame, column: Column):
+    if column.source is None or column.source not in df.columns:
+        return np.full(len(df), column.default, dtype=object)
+    values = df[column.source]
+    if column.dtype == "number" and values.dtype == object:
+        numbers = pd.to_numeric(values, errors="coerce")
+        # Only convert when nothing would be lost, so "N/A" and the like survive
+        if numbers.notna().sum() == values.notna().sum():
+            return numbers.to_numpy()
+    return values.to_numpy()
+
+
+def transform_data(df: pd.DataFrame) -> pd.DataFrame:
+    """Transforms the DataFrame of extracted fields to the final required format."""
+    return pd.DataFrame(
+        {column.target: _column_values(df, column) for column in OUTPUT_COLUMNS},
+        index=df.index,
+        columns=[column.target for column in OUTPUT_COLUMNS],
+    )
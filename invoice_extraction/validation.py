@@ -0,0 +1,102 @@
+"""Consistency checks across extracted invoice fields.
+
+The schema only checks that each value is well-formed on its own. These
+checks catch answers that are well-formed but wrong: a GSTIN whose check
+character does not match, an IRN or date that cannot be read, or amounts
+that do not add up. Each check is written once, for a single invoice;
+validate_frame() applies them to every row of a batch.
+"""
+import os
+import re
+import math
+
+import pandas as pd
+
+from invoice_extraction.schema import IRN_PATTERN, NOT_AVAILABLE
+
+GSTIN_CHARSET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+GSTIN_FIELDS = ("GSTIN Number", "TML GSTIN")
+
+# Amounts may differ by rounding: up to this many rupees, or this fraction of the larger amount
+AMOUNT_TOLERANCE = float(os.getenv("AMOUNT_TOLERANCE", "1.0"))
+AMOUNT_RELATIVE_TOLERANCE = float(os.getenv("AMOUNT_RELATIVE_TOLERANCE", "0.005"))
+
+# Fields a check can flag, in the order of the prompt
+CHECKED_FIELDS = [
+    "Quantity", "Rate", "Basic amount without tax", "IGST", "Total Amount", "Ack Date", "GSTIN Number", "TML GSTIN", "IRN",
+]
+
+_GSTIN_WEIGHTS = (1, 2) * 7
+
+
+def _string(value) -> str:
+    # pd.isna() is only True for a missing scalar (None, NaN, NA), never for a string or list
+    if pd.isna(value) is True:
+        return ""
+    return str(value).strip()
+
+
+def _amount(value):
+    """Returns a field as a float, or None where it is N/A or not a number (e.g. "6,000.00" reads as 6000)."""
+    try:
+        amount = float(_string(value).replace(",", ""))
+    except ValueError:
+        return None
+    return None if math.isnan(amount) else amount
+
+
+def gstin_checksum_valid(gstin: str) -> bool:
+    """Returns whether a GSTIN's 15th character matches the mod-36 checksum of the first 14."""
+    gstin = gstin.upper()
+    if not re.fullmatch(r"[0-9A-Z]{15}", gstin):
+        return False
+    digits = [GSTIN_CHARSET.index(char) for char in gstin]
+    products = [digit * weight for digit, weight in zip(digits[:14], _GSTIN_WEIGHTS)]
+    total = sum(product // 36 + product % 36 for product in products)
+    return (36 - total % 36) % 36 == digits[14]
+
+
+def amounts_match(expected: float, actual: float) -> bool:
+    tolerance = max(AMOUNT_TOLERANCE, AMOUNT_RELATIVE_TOLERANCE * max(abs(expected), abs(actual)))
+    return abs(expected - actual) <= tolerance
+
+
+def consistency_errors(data: dict) -> dict:
+    """Returns {field: error} for one invoice's fields that fail a check.
+
+    Each field gets the error of the first failed check implicating it. Checks
+    with an N/A or missing value are skipped.
+    """
+    errors = {}
+
+    def flag(fields, message: str):
+        for field in fields:
+            errors.setdefault(field, message)
+
+    values = {field: _string(data.get(field)) for field in ("Ack Date", "IRN", *GSTIN_FIELDS)}
+    present = {field: value not in ("", NOT_AVAILABLE) for field, value in values.items()}
+    for field in GSTIN_FIELDS:
+        if present[field] and not gstin_checksum_valid(values[field]):
+            flag([field], "fails the GSTIN checksum")
+    if present["IRN"] and not re.fullmatch(IRN_PATTERN, values["IRN"].lower()):
+        flag(["IRN"], "is not a 64-character hexadecimal IRN")
+    if present["Ack Date"] and pd.isna(pd.to_datetime(values["Ack Date"], format="mixed", dayfirst=True, errors="coerce")):
+        flag(["Ack Date"], "is not a recognizable date")
+
+    quantity, rate = _amount(data.get("Quantity")), _amount(data.get("Rate"))
+    basic, igst, total = _amount(data.get("Basic amount without tax")), _amount(data.get("IGST")), _amount(data.get("Total Amount"))
+    if None not in (quantity, rate, basic) and not amounts_match(quantity * rate, basic):
+        flag(["Quantity", "Rate", "Basic amount without tax"], "Quantity x Rate does not match the basic amount")
+    if None not in (basic, igst, total) and not amounts_match(basic + igst, total):
+        flag(["Basic amount without tax", "IGST", "Total Amount"], "Basic amount + IGST does not match the total amount")
+    return {field: errors[field] for field in CHECKED_FIELDS if field in errors}
+
+
+def validate_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Runs the checks over rows of extracted fields.
+
+    Returns a frame with the same index and one column per checked field,
+    holding that field's error from consistency_errors(), or NaN.
+    """
+    rows = [consistency_errors(row) for row in df.to_dict("records")]
+    return pd.DataFrame(rows, index=df.index, columns=CHECKED_FIELDS, dtype=object)
@@ -1,21 +1,53 @@
 
 import os
 import json
-from typing import List
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, status
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-import pandas as pd
-import pdfplumber
-from openai import OpenAI
+from opentelemetry import trace
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from invoice_extraction.jobs import JobRunner, JobStore
+from invoice_extraction.llm import LLMError, llm_router, llm_scheduler
+from invoice_extraction.metrics import IN_FLIGHT, time_stage
+from invoice_extraction.pdf_pool import PdfExtractionError, get_pool
+from invoice_extraction.pipeline import ExtractionPipeline, nothing_extracted
+from invoice_extraction.resilience import DeadlineExceeded, request_deadline
+from invoice_extraction.tracing import stage, tracer
+from invoice_extraction.validation import consistency_errors
 
 # Load environment variables
 load_dotenv()
 
-# Set up OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Parsing, pre-extraction, LLM, validation and transform are shared with the Streamlit app
+pipeline = ExtractionPipeline()
 
-app = FastAPI()
+# PDF parsing is CPU-bound, so it is submitted to a pool of worker processes
+pdf_pool = get_pool()
+
+# Deadline for every LLM call made while serving one /api/extract request, retries included (0 = none)
+EXTRACT_DEADLINE_SECONDS = float(os.getenv("EXTRACT_DEADLINE_SECONDS", "110"))
+
+# Cap on files processed at once within a single request
+MAX_CONCURRENT_FILES_PER_REQUEST = int(os.getenv("MAX_CONCURRENT_FILES_PER_REQUEST", "5"))
+
+# Largest batch accepted by the background job API
+JOB_MAX_FILES = int(os.getenv("JOB_MAX_FILES", "1000"))
+job_store = JobStore()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pdf_pool.start()
+    job_runner = JobRunner(job_store, extract_invoice, concurrency=MAX_CONCURRENT_FILES_PER_REQUEST)
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    pdf_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 origins = [
@@ -31,153 +63,181 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def extract_text_from_pdf(pdf_file):
-    """Extracts text from a given PDF file."""
+async def extract_invoice(data: bytes, filename: str):
+    """Extracts structured data from one PDF's bytes, or None if every field is N/A; engine errors become HTTP errors."""
     try:
-        with pdfplumber.open(pdf_file) as pdf:
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-        return text
-    except Exception as e:
+        extracted_data = await pipeline.extract(data, filename)
+        return None if nothing_extracted(extracted_data) else extracted_data
+    except PdfExtractionError as e:
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {e}")
-
-def get_info_from_llm(text: str):
-    """Sends extracted text to OpenAI API and returns structured data."""
-    prompt = f"""
-    You are an expert data extractor. From the following invoice text, extract the specified fields and return the data in a clean JSON format.
-    If a field is not present, its value should be "N/A".
-
-    The JSON keys should be exactly as specified in the "Fields to Extract" list.
-
-    **Fields to Extract:**
-    - "Buyer's Order No."
-    - "Quantity"
-    - "Rate"
-    - "Basic amount without tax"
-    - "IGST"
-    - "Total Amount"
-    - "InvoiceNo"
-    - "Ack Date"
-    - "GSTIN Number"
-    - "TML GSTIN"
-    - "IRN"
-
-    **Extraction Guidelines:**
-    - "Quantity", "Rate", "Basic amount without tax", and "Total Amount" are usually found within the table describing the goods.
-    - For "Quantity" and "Rate", extract only the integer value. For example, if the quantity is "5 Nos", the value should be 5.
-    - For "InvoiceNo", look for a label like "Invoice No.". The value can be alphanumeric with slashes, like "SW/25-26/2513".
-    - For "Ack Date", look for a label like "Dated" or "Ack Date".
-    - For "IGST", find the value for IGST tax. It might be under a description of taxes.
-    - For "GSTIN Number", this is the GSTIN for the "Sunrise Wheels".
-    - For "TML GSTIN", this is the GSTIN for the "Buyer" or "Bill to" party.
-
-    **Invoice Text:**
-    ---
-    {text}
-    ---
-    """
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"Extraction deadline exceeded: {e}")
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def process_file(file: UploadFile, request_semaphore: asyncio.Semaphore):
+    """Extracts structured data from one uploaded PDF."""
+    async with request_semaphore:
+        with stage("upload", **{"file.name": file.filename}):
+            data = await file.read()
+        return await extract_invoice(data, file.filename)
+
+def format_event(event: dict, stream: str) -> str:
+    """Serializes one streamed event as an NDJSON line or a Server-Sent Event."""
+    payload = json.dumps(event)
+    if stream == "sse":
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+async def stream_extraction(batch: list, stream: str, request_span: trace.Span):
+    """Yields each file's transformed row, or its error, as soon as that file finishes, then ends request_span."""
+    request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILES_PER_REQUEST)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + EXTRACT_DEADLINE_SECONDS if EXTRACT_DEADLINE_SECONDS else None
+
+    async def run(index: int, filename: str, data: bytes):
+        # The deadline and parent span are set inside each task, since a generator cannot hold a context variable across yields
+        with trace.use_span(request_span), request_deadline(deadline - loop.time() if deadline is not None else 0):
+            async with request_semaphore:
+                try:
+                    return index, filename, await extract_invoice(data, filename), None
+                except HTTPException as e:
+                    return index, filename, None, e.detail
+
+    tasks = [asyncio.create_task(run(index, filename, data)) for index, (filename, data) in enumerate(batch)]
+    succeeded = 0
+    in_flight = IN_FLIGHT.labels("requests")
+    in_flight.inc()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant designed to extract information from documents and return it as a single JSON object. The keys in the JSON should be exactly as requested in the prompt."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error calling OpenAI API: {e}")
-
-def transform_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Transforms the DataFrame to the final required format."""
-    if "Buyer's Order No." in df.columns:
-        df.rename(columns={"Buyer's Order No.": "PoNumber"}, inplace=True)
-    if "InvoiceNo" in df.columns:
-        df.rename(columns={"InvoiceNo": "Vendor Challan No"}, inplace=True)
-    if "Ack Date" in df.columns:
-        df.rename(columns={"Ack Date": "Challan Date"}, inplace=True)
-    if "Basic amount without tax" in df.columns:
-        df.rename(columns={"Basic amount without tax": "Basic value"}, inplace=True)
-    if "IGST" in df.columns:
-        df.rename(columns={"IGST": "IGST VALUE"}, inplace=True)
-    if "Total Amount" in df.columns:
-        df.rename(columns={"Total Amount": "INVOICE VALUE"}, inplace=True)
-    if "Rate" in df.columns:
-        df.rename(columns={"Rate": "Gross Rate"}, inplace=True)
-
-    final_df = pd.DataFrame()
-    final_df['PO NUMBER'] = df.get('PoNumber')
-    final_df['PO Item No'] = ''
-    final_df['Quantity'] = df.get('Quantity')
-    final_df['VENDOR CHALLAN NO'] = df.get('Vendor Challan No')
-    final_df['Challan Date'] = df.get('Challan Date')
-    final_df['Gross Rate'] = df.get('Gross Rate')
-    final_df['Net P O Rate'] = df.get('Gross Rate')
-    final_df['Basic Value'] = df.get('Basic value')
-    final_df['Taxable Value'] = df.get('Basic value')
-    final_df['SGST VALUE'] = ''
-    final_df['CGST VALUE'] = ''
-    final_df['IGST VALUE'] = df.get('IGST VALUE')
-    final_df['SGST RATE'] = ''
-    final_df['CGST RATE'] = ''
-    final_df['IGST RATE'] = ''
-    final_df['Packing Amount'] = ''
-    final_df['Freight Amount'] = ''
-    final_df['Others Amount'] = ''
-    final_df['INVOICE VALUE'] = df.get('INVOICE VALUE')
-    final_df['Currency'] = 'INR'
-    final_df['E Way Bill'] = ''
-    final_df['57F4 NUMBER'] = ''
-    final_df['57F4 NO DATE'] = ''
-    final_df['GSTIN Number'] = df.get('GSTIN Number')
-    final_df['Vehicle Number'] = ''
-    final_df['PART REV Level'] = ''
-    final_df['COP Certificate'] = ''
-    final_df['Certificate Date'] = ''
-    final_df['TML GSTIN'] = df.get('TML GSTIN')
-    final_df['Digital Invoice File Name'] = ''
-    final_df['IRN'] = df.get('IRN')
-    final_df['TCS Value'] = ''
-    final_df['Field4'] = ''
-    final_df['Field5'] = ''
-
-    return final_df
+        with time_stage("request"):
+            for next_done in asyncio.as_completed(tasks):
+                index, filename, extracted_data, error = await next_done
+                if extracted_data is None:
+                    event = {"type": "error", "index": index, "filename": filename,
+                             "error": error or "No data could be extracted from the file."}
+                else:
+                    # to_json turns numpy scalars into plain JSON values
+                    with trace.use_span(request_span):
+                        row = json.loads(pipeline.transform([extracted_data]).to_json(orient='records'))[0]
+                    event = {"type": "row", "index": index, "filename": filename, "row": row,
+                             "flags": consistency_errors(extracted_data)}
+                    succeeded += 1
+                yield format_event(event, stream)
+            yield format_event({"type": "done", "succeeded": succeeded, "failed": len(batch) - succeeded}, stream)
+    finally:
+        in_flight.dec()
+        request_span.end()
+        # Stop work nobody will receive if the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
 
 @app.post("/api/extract")
-async def extract_data_from_pdfs(files: List[UploadFile] = File(...)):
+async def extract_data_from_pdfs(files: List[UploadFile] = File(...), stream: Optional[Literal["ndjson", "sse"]] = None):
+    """Extracts rows from up to 10 PDFs, or with ?stream=ndjson|sse streams each row as its file finishes."""
     if len(files) > 10:
         raise HTTPException(status_code=400, detail="You can only upload a maximum of 10 files at a time.")
 
-    all_data = []
     for file in files:
         if file.content_type != 'application/pdf':
             raise HTTPException(status_code=400, detail=f"File '{file.filename}' is not a PDF.")
-        
-        text = extract_text_from_pdf(file.file)
-        
-        extracted_data_str = get_info_from_llm(text)
-        
+
+    if stream is not None:
+        # The request span outlives this handler, so the stream ends it once the last event is sent
+        request_span = tracer.start_span("request", attributes={"files": len(files), "stream": stream})
         try:
-            if '```json' in extracted_data_str:
-                extracted_data_str = extracted_data_str.split('```json\n')[1].split('```')[0]
-            extracted_data = json.loads(extracted_data_str)
-            all_data.append(extracted_data)
-        except (json.JSONDecodeError, IndexError) as e:
-            # Maybe log the error and the problematic string
-            print(f"Error parsing JSON for {file.filename}: {e}")
-            print(f"LLM Response: {extracted_data_str}")
-            # Decide if you want to skip the file or return an error
-            continue # simple skip for now
+            with trace.use_span(request_span), stage("upload", files=len(files)):
+                batch = [(file.filename, await file.read()) for file in files]
+        except BaseException:
+            request_span.end()
+            raise
+        media_type = "text/event-stream" if stream == "sse" else "application/x-ndjson"
+        return StreamingResponse(stream_extraction(batch, stream, request_span), media_type=media_type)
+
+    # Files are processed concurrently; gather keeps the results in upload order
+    # The deadline covers every LLM call made for this request, including retries
+    request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILES_PER_REQUEST)
+    with IN_FLIGHT.labels("requests").track_inprogress(), stage("request", files=len(files)):
+        with request_deadline(EXTRACT_DEADLINE_SECONDS):
+            tasks = [asyncio.create_task(process_file(file, request_semaphore)) for file in files]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                # The first failure decides the response, so stop paying for the other files
+                for task in tasks:
+                    task.cancel()
+                raise
+        all_data = [data for data in results if data is not None]
+
+        if not all_data:
+            raise HTTPException(status_code=400, detail="No data could be extracted from the provided files.")
+
+        final_df = pipeline.transform(all_data)
+
+        return final_df.to_dict(orient='records')
+
+@app.post("/api/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_extraction_job(files: List[UploadFile] = File(...)):
+    """Queues a batch of PDFs for background extraction and returns the job id to poll."""
+    if len(files) > JOB_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"You can only upload a maximum of {JOB_MAX_FILES} files per job.")
 
+    for file in files:
+        if file.content_type != 'application/pdf':
+            raise HTTPException(status_code=400, detail=f"File '{file.filename}' is not a PDF.")
+
+    # Each upload is stored as soon as it is read, so only one file is held in memory at a time
+    job_id = await asyncio.to_thread(job_store.create_job, len(files))
+    try:
+        for position, file in enumerate(files):
+            data = await file.read()
+            await asyncio.to_thread(job_store.add_file, job_id, position, file.filename, data)
+    except BaseException:
+        await asyncio.to_thread(job_store.delete_job, job_id)
+        raise
+    await asyncio.to_thread(job_store.queue_job, job_id)
+    return {"job_id": job_id, "status": "queued", "total": len(files)}
+
+@app.get("/api/jobs/{job_id}")
+async def get_extraction_job(job_id: str):
+    """Returns a job's status and progress."""
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    job["errors"] = await asyncio.to_thread(job_store.errors, job_id)
+    return job
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_extraction_job_result(job_id: str):
+    """Returns a finished job's rows in the same format as /api/extract."""
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' is still {job['status']}.")
+
+    all_data = await asyncio.to_thread(job_store.results, job_id)
     if not all_data:
         raise HTTPException(status_code=400, detail="No data could be extracted from the provided files.")
 
-    df = pd.DataFrame(all_data)
-    final_df = transform_data(df)
+    final_df = pipeline.transform(all_data)
 
     return final_df.to_dict(orient='records')
 
+@app.get("/api/llm/scheduler")
+def get_llm_scheduler_status():
+    """Returns the LLM rate limiter's queue depth and budgets."""
+    return llm_scheduler.status()
+
+@app.get("/api/llm/tiers")
+def get_llm_tier_metrics():
+    """Returns per-model call counts, latency, tokens and estimated cost of the routing tiers."""
+    return llm_router.status()
+
+@app.get("/metrics")
+def get_metrics():
+    """Returns the Prometheus metrics of this worker process."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the PDF Data Extractor API"}
@@ -0,0 +1,200 @@
+"""Benchmarks of each pipeline stage, with regression checks against a stored run.
+
+Measures wall time, CPU time and peak Python memory (tracemalloc) of:
+- PDF parsing on synthetic invoices of 1, 5 and 50 pages, plus any --samples
+- rule-based pre-extraction and prompt compaction on the parsed text
+- parsing and validating LLM JSON answers
+- validate_frame and transform_data on batches of 1 to 1000 rows
+
+    python tools/benchmark.py --output benchmarks/baseline.json
+    python tools/benchmark.py --compare benchmarks/baseline.json --threshold 0.2
+
+A comparison run exits with status 1 when any stage's median time exceeds
+the stored one by more than the threshold.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The LLM module builds its client at import; the benchmark never calls it
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import pandas as pd
+
+from invoice_extraction.compaction import compact_invoice_text
+from invoice_extraction.llm import parse_llm_json
+from invoice_extraction.pdf_pool import parse_pdf
+from invoice_extraction.prompts import FIELDS
+from invoice_extraction.rules import extract_fields
+from invoice_extraction.schema import validate_fields
+from invoice_extraction.transform import transform_data
+from invoice_extraction.validation import validate_frame
+
+PAGE_COUNTS = [1, 5, 50]
+ROW_COUNTS = [1, 10, 100, 1000]
+
+ANSWER = {
+    "Buyer's Order No.": "5500012345",
+    "Quantity": 5,
+    "Rate": "1,200.00",
+    "Basic amount without tax": 6000,
+    "IGST": 1080,
+    "Total Amount": 7080,
+    "InvoiceNo": "SW/25-26/2513",
+    "Ack Date": "12-Apr-25",
+    "GSTIN Number": "27AAPFU0939F1ZV",
+    "TML GSTIN": "27AAACT2727Q1ZW",
+    "IRN": "a" * 64,
+}
+
+INVOICE_LINES = [
+    "TAX INVOICE",
+    "Sunrise Wheels  GSTIN/UIN: 27AAPFU0939F1ZV",
+    "IRN : " + "a" * 64,
+    "Ack No. : 112510123456789   Ack Date : 12-Apr-25",
+    "Invoice No. SW/25-26/2513   Dated 12-Apr-25",
+    "Buyer (Bill to)  Tata Motors Limited  GSTIN/UIN: 27AAACT2727Q1ZW",
+    "Buyer's Order No. 5500012345",
+    "Sl  Description of Goods   HSN/SAC   Quantity   Rate   Amount",
+    "1   Wheel Rim 6.00x16      87087000  5 Nos      1200   6000.00",
+    "IGST @ 18%   1080.00",
+    "Total   7080.00",
+    "Terms & Conditions: Subject to Pune jurisdiction. This is a computer generated invoice.",
+]
+
+
+def synthetic_invoice_pdf(pages: int) -> bytes:
+    """Returns a text-only invoice PDF of the given page count, written without any PDF library."""
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for page in range(pages):
+        page_id, content_id = 4 + 2 * page, 5 + 2 * page
+        lines = INVOICE_LINES + [f"Page {page + 1} of {pages}"] + [f"Line item continuation {page}-{n}" for n in range(30)]
+        stream = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({escape(line)}) '" for line in lines) + " ET"
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream.encode())
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(b"%d 0 R" % page_id)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, objects[number])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offsets[number] for number in sorted(objects))
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def measure(function, repeat: int) -> dict:
+    """Returns the median wall and CPU seconds over repeat runs, and the peak traced memory of one more.
+
+    Memory is traced in its own run, since tracemalloc slows down the code it traces.
+    """
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        function()
+        cpus.append(time.process_time() - cpu)
+        walls.append(time.perf_counter() - wall)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "wall_seconds": round(statistics.median(walls), 6),
+        "cpu_seconds": round(statistics.median(cpus), 6),
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(repeat: int, samples: list) -> dict:
+    documents = [(f"synthetic_{pages}_pages", synthetic_invoice_pdf(pages)) for pages in PAGE_COUNTS]
+    for path in samples:
+        with open(path, "rb") as f:
+            documents.append((f"sample_{os.path.basename(path)}", f.read()))
+
+    results = {}
+    for name, data in documents:
+        # Fewer rounds for the big documents so a run stays short
+        rounds = max(1, repeat // 5) if len(data) > 200_000 or "50_pages" in name else repeat
+        results[f"parse_pdf/{name}"] = measure(lambda: parse_pdf(data), rounds)
+        parsed = parse_pdf(data)
+        results[f"extract_fields/{name}"] = measure(lambda: extract_fields(parsed.text), repeat)
+        results[f"compact_invoice_text/{name}"] = measure(lambda: compact_invoice_text(parsed.pages, FIELDS), repeat)
+
+    fenced = "```json\n" + json.dumps(ANSWER) + "\n```"
+    results["parse_llm_json"] = measure(lambda: [parse_llm_json(fenced) for _ in range(100)], repeat)
+    results["validate_fields"] = measure(lambda: [validate_fields(ANSWER, FIELDS) for _ in range(100)], repeat)
+
+    for rows in ROW_COUNTS:
+        records = [dict(ANSWER, Quantity=n % 50 + 1) for n in range(rows)]
+        results[f"validate_frame/{rows}_rows"] = measure(lambda: validate_frame(pd.DataFrame(records)), repeat)
+        results[f"transform_data/{rows}_rows"] = measure(lambda: transform_data(pd.DataFrame(records)), repeat)
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float, metric: str) -> list:
+    """Returns a line per stage slower than the baseline by more than threshold (a fraction)."""
+    regressions = []
+    for stage, result in current.items():
+        before = baseline.get(stage)
+        if before is None or not before[metric]:
+            continue
+        change = result[metric] / before[metric] - 1
+        if change > threshold:
+            regressions.append(f"{stage}: {metric} {before[metric]:.6f} -> {result[metric]:.6f} (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="rounds per stage; the median is reported")
+    parser.add_argument("--samples", nargs="*", default=[], help="real invoice PDFs (or globs) to benchmark too")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown per stage, as a fraction")
+    parser.add_argument("--metric", choices=["cpu_seconds", "wall_seconds"], default="cpu_seconds",
+                        help="time compared against the baseline; CPU time is less noisy on shared machines")
+    args = parser.parse_args()
+
+    samples = sorted({path for pattern in args.samples for path in glob.glob(pattern)})
+    results = run_benchmarks(args.repeat, samples)
+
+    width = max(len(stage) for stage in results)
+    print(f"{'stage':<{width}}  {'wall ms':>10}  {'cpu ms':>10}  {'peak KiB':>10}")
+    for stage, result in results.items():
+        print(f"{stage:<{width}}  {result['wall_seconds'] * 1000:>10.2f}  {result['cpu_seconds'] * 1000:>10.2f}"
+              f"  {result['peak_bytes'] / 1024:>10.0f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "repeat": args.repeat,
+                       "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.metric)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage slower than the baseline by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Load generator for /api/extract.
+
+Posts PDFs from a corpus at each concurrency level and reports throughput,
+p50/p95/p99 latency and error rates. Each upload gets a unique trailing PDF
+comment by default, so the result cache does not turn the run into a cache
+benchmark; pass --no-vary to measure cache hits instead.
+
+    python tools/load_test.py samples/*.pdf --concurrency 1 5 10 --requests 50 --files-per-request 3
+"""
+import sys
+import glob
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+from collections import Counter
+
+import httpx
+
+
+def percentile(values: list, pct: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def make_upload(corpus: list, index: int, files_per_request: int, vary: bool) -> list:
+    """Returns the multipart files of one request, cycling through the corpus."""
+    files = []
+    for offset in range(files_per_request):
+        name, data = corpus[(index * files_per_request + offset) % len(corpus)]
+        if vary:
+            # Bytes after %%EOF are ignored by PDF readers but change the content hash
+            data = data + f"\n% load-test {uuid.uuid4().hex}\n".encode()
+        files.append(("files", (name, data, "application/pdf")))
+    return files
+
+
+async def run_level(client: httpx.AsyncClient, url: str, corpus: list, concurrency: int, requests: int,
+                    files_per_request: int, vary: bool) -> dict:
+    """Sends the requests with at most `concurrency` in flight and summarizes the results."""
+    latencies, statuses = [], Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        async with semaphore:
+            files = make_upload(corpus, index, files_per_request, vary)
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, files=files)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                return
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    succeeded = len(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": succeeded,
+        "error_rate": round(1 - succeeded / requests, 4),
+        "errors": {str(code): count for code, count in statuses.items() if code != 200},
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(succeeded / elapsed, 3),
+        "files_per_second": round(succeeded * files_per_request / elapsed, 3),
+        "p50_seconds": round(percentile(latencies, 50), 3),
+        "p95_seconds": round(percentile(latencies, 95), 3),
+        "p99_seconds": round(percentile(latencies, 99), 3),
+    }
+
+
+def print_report(results: list):
+    columns = ["concurrency", "succeeded", "error_rate", "requests_per_second", "files_per_second",
+               "p50_seconds", "p95_seconds", "p99_seconds"]
+    print("  ".join(f"{column:>19}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>19}" for column in columns))
+        if result["errors"]:
+            print(f"{'':>19}  errors: {result['errors']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="+", help="PDF files or glob patterns making up the corpus")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/extract")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10], help="levels to run, in order")
+    parser.add_argument("--requests", type=int, default=50, help="requests per concurrency level")
+    parser.add_argument("--files-per-request", type=int, default=1, help="PDFs per request (the API accepts up to 10)")
+    parser.add_argument("--no-vary", dest="vary", action="store_false", help="send identical bytes, hitting the result cache")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a request counts as failed")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.pdfs for path in glob.glob(pattern)})
+    if not paths:
+        sys.exit("No PDFs found")
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as f:
+            corpus.append((path.rsplit("/", 1)[-1], f.read()))
+
+    results = []
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        for concurrency in args.concurrency:
+            print(f"Running {args.requests} requests at concurrency {concurrency}...", file=sys.stderr)
+            results.append(await run_level(client, args.url, corpus, concurrency, args.requests,
+                                           args.files_per_request, args.vary))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"url": args.url, "corpus": paths, "files_per_request": args.files_per_request,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""Local stand-in for the OpenAI chat-completions endpoint, for load tests that cost nothing.
+
+Answers every request after a sampled latency, fails a configurable share
+of them with 429 or 5xx, and otherwise answers the forced extraction tool
+call with canned field values. Point the service at it with the SDK's own
+base-URL setting:
+
+    python tools/mock_openai.py --port 8001 --latency lognormal --latency-median 1.5 --rate-429 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock uvicorn main:app
+"""
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Values answered for each field, unless --answers gives a JSON file of others
+DEFAULT_ANSWERS = {
+    "Buyer's Order No.": "5500012345",
+    "Quantity": 5,
+    "Rate": 1200,
+    "Basic amount without tax": 6000,
+    "IGST": 1080,
+    "Total Amount": 7080,
+    "InvoiceNo": "SW/25-26/2513",
+    "Ack Date": "12-Apr-25",
+    "GSTIN Number": "27AAPFU0939F1ZV",
+    "TML GSTIN": "27AAACT2727Q1ZW",
+    "IRN": "a" * 64,
+}
+
+app = FastAPI()
+settings = argparse.Namespace(latency="fixed", latency_median=1.0, latency_sigma=0.5, rate_429=0.0, rate_5xx=0.0,
+                              answers=DEFAULT_ANSWERS)
+
+
+def sample_latency() -> float:
+    """Returns a latency in seconds from the configured distribution."""
+    median = settings.latency_median
+    if settings.latency == "uniform":
+        return random.uniform(0, 2 * median)
+    if settings.latency == "lognormal":
+        # Long right tail, like real completions: the median is exp(mu)
+        return random.lognormvariate(0, settings.latency_sigma) * median
+    if settings.latency == "exponential":
+        return random.expovariate(1 / median) if median else 0.0
+    return median
+
+
+def error_response(status: int, message: str, kind: str) -> JSONResponse:
+    headers = {"retry-after": "1"} if status == 429 else None
+    return JSONResponse({"error": {"message": message, "type": kind, "code": None}}, status_code=status, headers=headers)
+
+
+def answer_for(schema: dict, prompt: str) -> dict:
+    """Builds canned arguments matching the requested tool schema, for one invoice or a batch."""
+    properties = schema.get("properties", {})
+    if "invoices" in properties:
+        fields = [field for field in properties["invoices"]["items"]["properties"] if field != "file_id"]
+        file_ids = re.findall(r'\*\*Invoice "([^"]+)"\*\*', prompt)
+        return {"invoices": [{"file_id": file_id, **{field: settings.answers.get(field, "N/A") for field in fields}}
+                             for file_id in file_ids]}
+    return {field: settings.answers.get(field, "N/A") for field in properties}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(sample_latency())
+
+    roll = random.random()
+    if roll < settings.rate_429:
+        return error_response(429, "Rate limit reached (injected by mock)", "requests")
+    if roll < settings.rate_429 + settings.rate_5xx:
+        return error_response(random.choice([500, 502, 503]), "Server error (injected by mock)", "server_error")
+
+    prompt = "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+    tools = body.get("tools") or []
+    arguments = answer_for(tools[0]["function"]["parameters"], prompt) if tools else dict(settings.answers)
+    if tools:
+        message = {"role": "assistant", "content": None, "tool_calls": [{
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {"name": tools[0]["function"]["name"], "arguments": json.dumps(arguments)},
+        }]}
+    else:
+        message = {"role": "assistant", "content": json.dumps(arguments)}
+
+    # Roughly 4 characters per token, like the service's own offline estimate
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(json.dumps(arguments)) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tools else "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal", "exponential"], default="fixed",
+                        help="latency distribution of each completion")
+    parser.add_argument("--latency-median", type=float, default=1.0, help="median latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="spread of the lognormal distribution")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="share of requests answered with 500/502/503")
+    parser.add_argument("--answers", help="JSON file of {field: value} to answer instead of the defaults")
+    args = parser.parse_args()
+
+    answers = DEFAULT_ANSWERS
+    if args.answers:
+        with open(args.answers) as f:
+            answers = json.load(f)
+    vars(settings).update(vars(args), answers=answers)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()